@@ -0,0 +1,198 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Локальные заглушки внешних сервисов для бенчмарков.
+Содержит:
+- FakeAlmavivaServer: главная страница, /api/login и /api/getDisponibilityi, при необходимости с Turnstile
+- FakeTelegramServer: метод Bot API sendMessage
+- FakeCaptchaServer: методы createTask и getTaskResult сервиса решения капчи
+
+Каждый сервер слушает 127.0.0.1 на свободном порту, работает в отдельном потоке
+и считает полученные запросы, чтобы бенчмарк мог сравнить их количество между сборками.
+"""
+
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Время жизни выдаваемого токена авторизации и куки допуска в секундах
+TOKEN_TTL = 3600
+CLEARANCE_TTL = 2400
+
+MAIN_PAGE = """<!doctype html>
+<html><head><title>Almaviva</title></head>
+<body><div id="app">Almaviva Visa Services</div></body></html>
+"""
+
+# Страница проверки: скрипт «Cloudflare» вызывает turnstile.render, а колбэк ставит cf_clearance
+CHALLENGE_PAGE = """<!doctype html>
+<html><head><title>Just a moment...</title>
+<script src="/cdn-cgi/challenge-platform/turnstile.js"></script></head>
+<body>Checking your browser</body></html>
+"""
+
+CHALLENGE_SCRIPT = """
+window.turnstile = {render: function () {}};
+setTimeout(function () {
+  window.turnstile.render("#challenge", {
+    sitekey: "fake-site-key",
+    action: "managed",
+    cData: "fake-cdata",
+    chlPageData: "fake-pagedata",
+    callback: function (token) {
+      document.cookie = "cf_clearance=" + token + "; Max-Age=%d; Path=/";
+      location.reload();
+    }
+  });
+}, 50);
+""" % CLEARANCE_TTL
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+def make_token(ttl=TOKEN_TTL):
+    """Создает JWT-подобный токен с полем exp."""
+    return ".".join([_b64({"alg": "none"}), _b64({"exp": int(time.time()) + ttl}), "signature"])
+
+
+class _FakeServer:
+    """Базовый класс заглушки: HTTP-сервер в отдельном потоке и счетчики запросов."""
+
+    def __init__(self):
+        self.requests = {}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def reset_counters(self):
+        with self._lock:
+            counters = dict(self.requests)
+            self.requests.clear()
+        return counters
+
+    @staticmethod
+    def reply(handler, status, body, content_type="application/json"):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    @staticmethod
+    def read_json(handler):
+        length = int(handler.headers.get("Content-Length", 0))
+        try:
+            return json.loads(handler.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def handle(self, handler, method):
+        raise NotImplementedError
+
+
+class FakeAlmavivaServer(_FakeServer):
+    """Заглушка сайта Almaviva."""
+
+    def __init__(self, available=False, challenge=False):
+        super().__init__()
+        self.available = available
+        self.challenge = challenge
+
+    def handle(self, handler, method):
+        path = urlparse(handler.path).path
+        cookies = handler.headers.get("Cookie", "")
+        if method == "GET" and path == "/":
+            self.count("main_page")
+            # Без куки допуска отдаем страницу проверки, как это делает Cloudflare
+            if self.challenge and "cf_clearance=" not in cookies:
+                self.reply(handler, 200, CHALLENGE_PAGE, "text/html; charset=utf-8")
+            else:
+                self.reply(handler, 200, MAIN_PAGE, "text/html; charset=utf-8")
+        elif method == "GET" and path.startswith("/cdn-cgi/challenge-platform/"):
+            self.count("challenge_script")
+            self.reply(handler, 200, CHALLENGE_SCRIPT, "application/javascript")
+        elif method == "POST" and path == "/api/login":
+            self.count("login")
+            body = self.read_json(handler)
+            if not body.get("email") or not body.get("password"):
+                self.reply(handler, 401, {"error": "invalid credentials"})
+                return
+            self.reply(handler, 200, {"accessToken": make_token(), "email": body["email"]})
+        elif method == "GET" and path == "/api/getDisponibilityi":
+            self.count("availability")
+            if not handler.headers.get("Authorization", "").startswith("Bearer "):
+                self.reply(handler, 401, {"error": "unauthorized"})
+                return
+            self.reply(handler, 200, "true" if self.available else "false", "text/plain")
+        else:
+            self.count("other")
+            self.reply(handler, 404, {"error": "not found"})
+
+
+class FakeTelegramServer(_FakeServer):
+    """Заглушка Telegram Bot API."""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def handle(self, handler, method):
+        path = urlparse(handler.path).path
+        if method == "POST" and path.endswith("/sendMessage"):
+            self.count("sendMessage")
+            length = int(handler.headers.get("Content-Length", 0))
+            form = parse_qs(handler.rfile.read(length).decode())
+            with self._lock:
+                self.messages.append(form.get("text", [""])[0])
+            self.reply(handler, 200, {"ok": True, "result": {}})
+        else:
+            self.reply(handler, 404, {"ok": False})
+
+
+class FakeCaptchaServer(_FakeServer):
+    """Заглушка API сервиса решения капчи: задача решается сразу."""
+
+    def handle(self, handler, method):
+        path = urlparse(handler.path).path
+        self.read_json(handler)
+        if method == "POST" and path == "/createTask":
+            self.count("createTask")
+            self.reply(handler, 200, {"errorId": 0, "taskId": 1})
+        elif method == "POST" and path == "/getTaskResult":
+            self.count("getTaskResult")
+            self.reply(handler, 200, {"errorId": 0, "status": "ready", "solution": {"token": "fake-turnstile-token"}})
+        else:
+            self.reply(handler, 404, {"errorId": 1})
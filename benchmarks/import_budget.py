@@ -0,0 +1,69 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Проверка времени холодного старта скрипта.
+
+Запускает `python -X importtime -c "import main"` в отдельном процессе и проверяет, что:
+- суммарное время импорта модулей при старте не превышает бюджет (--budget-ms)
+- до проверки настроек не загружаются тяжелые модули (requests, websocket, http.server)
+
+Выводит самые долгие импорты и завершается с кодом 1, если бюджет превышен,
+поэтому проверку можно запускать в CI или перед сборкой контейнера.
+
+Запуск из корня репозитория:
+    python -m benchmarks.import_budget --budget-ms 80
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Модули, которые должны загружаться только после проверки настроек
+LAZY_MODULES = ("requests", "websocket", "urllib3", "http.server")
+# Корень репозитория, из которого импортируется main
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure():
+    """Возвращает список (собственное время мкс, накопленное время мкс, модуль) импортов main."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((int(self_us), int(cumulative_us), name.strip()))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка времени холодного старта")
+    parser.add_argument("--budget-ms", type=float, default=80, help="бюджет суммарного времени импорта в мс")
+    parser.add_argument("--top", type=int, default=10, help="сколько самых долгих импортов вывести")
+    args = parser.parse_args()
+
+    imports = measure()
+    total_ms = sum(self_us for self_us, _, _ in imports) / 1000
+    for self_us, cumulative_us, name in sorted(imports, key=lambda i: i[1], reverse=True)[: args.top]:
+        print(f"  {cumulative_us / 1000:8.2f} мс  {name}")
+    print(f"Время импорта: {total_ms:.2f} мс (бюджет {args.budget_ms:g} мс)")
+
+    failed = False
+    loaded = sorted({name for _, _, name in imports if name in LAZY_MODULES})
+    if loaded:
+        print(f"При старте загружаются модули, которые должны импортироваться лениво: {', '.join(loaded)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("Бюджет времени импорта превышен")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
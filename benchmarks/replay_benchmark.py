@@ -0,0 +1,118 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Бенчмарк Python-части проверки по записи CDP, без браузера.
+
+Запись делается обычным запуском с CDP_RECORD=<папка> (например, вместе с run_benchmark):
+    CDP_RECORD=recordings python -m benchmarks.run_benchmark --checks 1
+
+Затем AlmavivaManager.run многократно выполняется поверх ReplayTransport, который
+отдает записанные ответы и события вместо Chrome. Telegram и сервис решения капчи
+подменяются локальными заглушками. Выводится время одного прогона и его этапов.
+
+Запись повторяет ровно тот путь, который был пройден при записи. Запись полного пути
+(капча и вход) воспроизводится всегда, запись быстрого пути — с флагом --session-valid
+и пока не истек записанный токен авторизации.
+
+Запуск из корня репозитория:
+    python -m benchmarks.replay_benchmark recordings/cdp-....jsonl.gz --runs 200
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmarks.fake_servers import FakeCaptchaServer, FakeTelegramServer
+
+
+def _recorded_base_url(path):
+    """Адрес сайта, на который выполнялся переход в записи: от него зависит origin JS-контекста."""
+    # Читаем файл напрямую: модули скрипта нельзя импортировать до настройки окружения
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for _, direction, message in map(json.loads, f):
+            if direction == "send" and message.get("method") == "Page.navigate":
+                return message["params"]["url"].rstrip("/")
+    raise SystemExit("В записи нет перехода Page.navigate")
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записи CDP без браузера")
+    parser.add_argument("recording", help="файл записи CDP (*.jsonl.gz)")
+    parser.add_argument("--runs", type=int, default=100, help="количество прогонов")
+    parser.add_argument("--session-valid", action="store_true", help="запись сделана по быстрому пути")
+    args = parser.parse_args()
+
+    telegram = FakeTelegramServer().start()
+    captcha = FakeCaptchaServer().start()
+    home = tempfile.mkdtemp(prefix="almaviva-replay-")
+
+    # Адреса и конфигурация читаются модулями при импорте, поэтому задаем их до импорта менеджеров
+    os.environ.update(
+        HOME=home,
+        CDP_REPLAY=args.recording,
+        ALMAVIVA_BASE_URL=_recorded_base_url(args.recording),
+        TELEGRAM_API_URL=telegram.url,
+        CAPTCHA_API_URL=captcha.url,
+        # Заглушка отдает решение сразу, поэтому ожидание перед опросом только исказило бы замер
+        CAPTCHA_POLL_INTERVAL="0",
+        CITY_ID="14",
+        CITY_NAME="Москва",
+        EMAIL="bench@example.com",
+        PASSWORD="bench",
+        CAPTCHA_API_KEY="bench",
+        TELEGRAM_BOT_TOKEN="0:bench",
+        TELEGRAM_CHAT_ID="1",
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+
+    from logger import metrics
+    from managers import settings as settings_loader
+    from managers.almaviva_manager import AlmavivaManager
+    from services.cdp_client import ReplayTransport
+    from services.session_service import SessionService
+
+    # Настройки берутся только из окружения бенчмарка, сохраненные значения пользователя не читаются
+    settings = settings_loader.load(config_path=None, require_interval=False)
+
+    # Запись читается и распаковывается один раз: в замер входит только работа проверки, а не чтение файла
+    ReplayTransport.preload(args.recording)
+
+    walls = []
+    phases = {}
+    try:
+        for _ in range(args.runs):
+            # Каждый прогон начинается с одинакового состояния сессии
+            session = SessionService(settings.city_id)
+            far_future = int(time.time()) + 86400 if args.session_valid else None
+            session.update(far_future, far_future)
+
+            metrics.begin_check()
+            started = time.perf_counter()
+            AlmavivaManager(devtools_url=None, settings=settings).run()
+            walls.append(time.perf_counter() - started)
+            for phase, seconds in metrics.end_check().items():
+                phases.setdefault(phase, []).append(seconds)
+    finally:
+        telegram.stop()
+        captcha.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+    print(
+        f"Прогонов: {len(walls)}, p50={statistics.median(walls) * 1000:.2f} мс, "
+        f"p95={_percentile(walls, 95) * 1000:.2f} мс, max={max(walls) * 1000:.2f} мс"
+    )
+    for phase, values in phases.items():
+        print(f"  {phase:<14} p50={statistics.median(values) * 1000:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Офлайн-бенчмарк проверки мест.
+
+Запускает локальные заглушки Almaviva, Telegram и сервиса решения капчи, подменяет
+их адреса через переменные окружения и выполняет ScheduleManager.job несколько раз
+против локального Chromium. Для каждой проверки выводит:
+- полное время проверки и время каждого этапа (из logger.metrics)
+- пиковый RSS процесса Python и дерева процессов Chrome
+- процессорное время Python и Chrome
+- количество запросов к каждой заглушке
+
+Первая проверка включает холодный запуск Chrome, остальные — работу с резидентным браузером.
+Для каждой проверки записывается ее исход; в итоговые p50/p95 попадают только успешные проверки
+(места есть или нет), а если хотя бы одна проверка не удалась, бенчмарк завершается с кодом 1.
+Предохранитель (CIRCUIT_BREAKER) отключен, чтобы после ошибок проверки не превращались в пропуски.
+Работает только на Linux (память и CPU дерева процессов читаются из /proc).
+
+Запуск из корня репозитория:
+    python -m benchmarks.run_benchmark --checks 5 --json bench.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fake_servers import FakeAlmavivaServer, FakeCaptchaServer, FakeTelegramServer
+from managers.process_tree import process_tree, read_stat, tree_rss
+
+# Интервал опроса памяти во время проверки в секундах
+SAMPLE_INTERVAL = 0.05
+
+
+def _chrome_pid():
+    from managers.schedule_manager import ScheduleManager
+    pm = ScheduleManager.process_manager
+    if pm is None or pm.chrome.process is None:
+        return None
+    return pm.chrome.process.pid
+
+
+def _chrome_cpu():
+    pid = _chrome_pid()
+    return sum(cpu for cpu, _ in process_tree(pid).values()) if pid else 0.0
+
+
+def _python_cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _PeakSampler:
+    """Фоновый опрос суммарного RSS дерева Chrome и RSS Python во время проверки."""
+
+    def __init__(self):
+        self.chrome_peak = 0
+        self.python_peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while True:
+            pid = _chrome_pid()
+            if pid:
+                self.chrome_peak = max(self.chrome_peak, tree_rss(pid))
+            stat = read_stat(os.getpid())
+            if stat:
+                self.python_peak = max(self.python_peak, stat[2])
+            if self._stop.wait(SAMPLE_INTERVAL):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк проверки мест Almaviva")
+    parser.add_argument("--checks", type=int, default=5, help="количество проверок")
+    parser.add_argument("--chrome", default=os.getenv("CHROME_PATH"), help="путь к Chromium (по умолчанию ищется в PATH)")
+    parser.add_argument("--headful", action="store_true", help="запускать Chrome с окном")
+    parser.add_argument("--available", action="store_true", help="заглушка сообщает о наличии мест")
+    parser.add_argument("--challenge", action="store_true", help="заглушка показывает Turnstile без куки допуска")
+    parser.add_argument("--json", help="файл для сохранения результатов")
+    args = parser.parse_args()
+
+    almaviva = FakeAlmavivaServer(available=args.available, challenge=args.challenge).start()
+    telegram = FakeTelegramServer().start()
+    captcha = FakeCaptchaServer().start()
+    home = tempfile.mkdtemp(prefix="almaviva-bench-")
+
+    # Адреса и конфигурация читаются модулями при импорте, поэтому задаем их до импорта менеджеров
+    os.environ.update(
+        HOME=home,
+        ALMAVIVA_BASE_URL=almaviva.url,
+        TELEGRAM_API_URL=telegram.url,
+        CAPTCHA_API_URL=captcha.url,
+        CITY_ID="14",
+        CITY_NAME="Москва",
+        EMAIL="bench@example.com",
+        PASSWORD="bench",
+        CAPTCHA_API_KEY="bench",
+        TELEGRAM_BOT_TOKEN="0:bench",
+        TELEGRAM_CHAT_ID="1",
+        # Пропущенные предохранителем проверки длятся миллисекунды и исказили бы замер
+        CIRCUIT_BREAKER="off",
+    )
+    if args.chrome:
+        os.environ["CHROME_PATH"] = args.chrome
+    if not args.headful:
+        os.environ["CHROME_EXTRA_ARGS"] = (os.getenv("CHROME_EXTRA_ARGS", "") + " --headless=new").strip()
+
+    from logger import metrics
+    from managers import settings
+    from managers.schedule_manager import ScheduleManager
+
+    # Настройки берутся только из окружения бенчмарка, сохраненные значения пользователя не читаются
+    ScheduleManager.settings = settings.load(config_path=None, require_interval=False)
+
+    results = []
+    try:
+        for i in range(args.checks):
+            python_cpu, chrome_cpu = _python_cpu(), _chrome_cpu()
+            started = time.perf_counter()
+            with _PeakSampler() as sampler:
+                outcome = ScheduleManager.job()
+            wall = time.perf_counter() - started
+            results.append(
+                {
+                    "check": i + 1,
+                    "cold": i == 0,
+                    "outcome": outcome,
+                    "ok": outcome in (metrics.AVAILABLE, metrics.UNAVAILABLE),
+                    "wall_s": round(wall, 4),
+                    "phases_s": {k: round(v, 4) for k, v in metrics.last_timings().items()},
+                    "python_cpu_s": round(_python_cpu() - python_cpu, 4),
+                    # При перезапуске Chrome счетчик начинается заново, поэтому не уходим в минус
+                    "chrome_cpu_s": round(max(_chrome_cpu() - chrome_cpu, 0.0), 4),
+                    "python_peak_rss_mb": round(sampler.python_peak / 2**20, 1),
+                    "chrome_peak_rss_mb": round(sampler.chrome_peak / 2**20, 1),
+                    "requests": {
+                        "almaviva": almaviva.reset_counters(),
+                        "telegram": telegram.reset_counters(),
+                        "captcha": captcha.reset_counters(),
+                    },
+                }
+            )
+            r = results[-1]
+            print(
+                f"#{r['check']:<3} {'cold' if r['cold'] else 'warm'} {r['outcome']} wall={r['wall_s']:.3f}s "
+                f"py_cpu={r['python_cpu_s']:.3f}s chrome_cpu={r['chrome_cpu_s']:.3f}s "
+                f"py_rss={r['python_peak_rss_mb']}MB chrome_rss={r['chrome_peak_rss_mb']}MB "
+                f"phases={r['phases_s']}"
+            )
+    finally:
+        ScheduleManager.shutdown()
+        almaviva.stop()
+        telegram.stop()
+        captcha.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+    # Неудачные проверки обрываются на ошибке, поэтому их время не говорит о скорости проверки
+    failed = [r for r in results if not r["ok"]]
+    warm = [r["wall_s"] for r in results if not r["cold"] and r["ok"]]
+    summary = {
+        "cold_wall_s": results[0]["wall_s"] if results and results[0]["ok"] else None,
+        "failed_checks": len(failed),
+    }
+    if warm:
+        summary.update(
+            warm_p50_s=round(statistics.median(warm), 4),
+            warm_p95_s=round(_percentile(warm, 95), 4),
+        )
+    print(f"Итог: {summary}")
+    if failed:
+        print("Неудачные проверки: " + ", ".join(f"#{r['check']} {r['outcome']}" for r in failed))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "checks": results}, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Модуль истории проверок в локальной базе SQLite.
+Содержит:
+- Функцию record, которая дописывает в историю исход проверки, результаты по городам и тайминги этапов
+- Функцию compact, которая удаляет записи старше срока хранения и возвращает место в файле базы
+- Функции checks, windows и summary для выборок из истории
+- Командную строку: python -m logger.history {checks,windows,summary}
+
+Хранится две таблицы:
+- checks и results: каждая проверка (время, исход или класс ошибки, тайминги) и результат по каждому городу,
+  хранятся HISTORY_RETENTION_DAYS дней (по умолчанию 30)
+- windows: окна наличия мест по городам (первая и последняя проверка с местами, первая проверка без мест),
+  обновляются при каждой записи и хранятся HISTORY_WINDOW_RETENTION_DAYS дней (по умолчанию 365),
+  поэтому отвечают на вопрос «когда появлялись места и сколько держались» и после удаления подробных записей
+
+Путь к базе задается HISTORY_DB (по умолчанию ~/almaviva-chrome-profiles/history.sqlite3), HISTORY_DB=off
+отключает историю. Ошибки базы пишутся в лог и не прерывают проверку.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from logger.logger import warning
+
+# Сколько дней хранить подробные записи о проверках и окна наличия мест
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+HISTORY_WINDOW_RETENTION_DAYS = float(os.getenv("HISTORY_WINDOW_RETENTION_DAYS", "365"))
+# Как часто удалять устаревшие записи, в секундах
+COMPACT_INTERVAL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checks (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS checks_ts ON checks (ts);
+CREATE TABLE IF NOT EXISTS results (
+    check_id INTEGER NOT NULL REFERENCES checks (id) ON DELETE CASCADE,
+    site_id INTEGER NOT NULL,
+    available INTEGER NOT NULL,
+    PRIMARY KEY (check_id, site_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS windows (
+    id INTEGER PRIMARY KEY,
+    site_id INTEGER NOT NULL,
+    started_at INTEGER NOT NULL,
+    last_seen_at INTEGER NOT NULL,
+    closed_at INTEGER,
+    checks INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS windows_site ON windows (site_id, closed_at);
+"""
+
+# Время последней очистки в этом процессе по монотонным часам (None — очистки еще не было)
+_last_compacted = None
+
+
+def db_path():
+    """Путь к базе истории или None, если история отключена."""
+    path = os.getenv("HISTORY_DB", os.path.expanduser("~") + "/almaviva-chrome-profiles/history.sqlite3")
+    if not path or path.lower() == "off":
+        return None
+    return path
+
+
+def _connect(path):
+    """Открывает базу и создает таблицы, если их еще нет."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    # Режим инкрементальной очистки задается до создания таблиц, иначе не действует
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL позволяет читать историю из API управления, пока идет запись
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record(outcome, results, timings, ts=None):
+    """
+    Дописывает проверку в историю.
+    outcome: исход проверки (константа из logger.metrics)
+    results: {идентификатор города: есть ли места} (пусто, если проверка не дошла до запроса мест)
+    timings: {этап: длительность в секундах}
+    """
+    global _last_compacted
+    path = db_path()
+    if path is None:
+        return
+    ts = int(ts if ts is not None else time.time())
+    # Тайминги храним в целых миллисекундах — этого достаточно и занимает меньше места
+    compact_timings = json.dumps({phase: round(seconds * 1000) for phase, seconds in timings.items()},
+                                 separators=(",", ":")) if timings else None
+    try:
+        conn = _connect(path)
+        try:
+            with conn:
+                check_id = conn.execute(
+                    "INSERT INTO checks (ts, outcome, timings) VALUES (?, ?, ?)", (ts, outcome, compact_timings)
+                ).lastrowid
+                for site_id, available in results.items():
+                    conn.execute(
+                        "INSERT INTO results (check_id, site_id, available) VALUES (?, ?, ?)",
+                        (check_id, int(site_id), int(available)),
+                    )
+                    _update_window(conn, int(site_id), available, ts)
+            # Устаревшие записи удаляем не чаще раза в сутки
+            if _last_compacted is None or time.monotonic() - _last_compacted >= COMPACT_INTERVAL:
+                _compact(conn, ts)
+                _last_compacted = time.monotonic()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        warning(f"Не удалось записать проверку в историю {path} - {e}")
+
+
+def _update_window(conn, site_id, available, ts):
+    """Продлевает или открывает окно наличия мест, если места есть, и закрывает его, если мест нет."""
+    window = conn.execute(
+        "SELECT id FROM windows WHERE site_id = ? AND closed_at IS NULL", (site_id,)
+    ).fetchone()
+    if available and window:
+        conn.execute("UPDATE windows SET last_seen_at = ?, checks = checks + 1 WHERE id = ?", (ts, window[0]))
+    elif available:
+        conn.execute(
+            "INSERT INTO windows (site_id, started_at, last_seen_at, checks) VALUES (?, ?, ?, 1)", (site_id, ts, ts)
+        )
+    elif window:
+        conn.execute("UPDATE windows SET closed_at = ? WHERE id = ?", (ts, window[0]))
+
+
+def _compact(conn, now):
+    """Удаляет записи старше срока хранения и возвращает освободившиеся страницы файлу."""
+    with conn:
+        conn.execute("DELETE FROM checks WHERE ts < ?", (now - HISTORY_RETENTION_DAYS * 86400,))
+        conn.execute(
+            "DELETE FROM windows WHERE closed_at IS NOT NULL AND closed_at < ?",
+            (now - HISTORY_WINDOW_RETENTION_DAYS * 86400,),
+        )
+    conn.execute("PRAGMA incremental_vacuum")
+    # Сбрасываем журнал WAL в основной файл, чтобы он не рос между очистками
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def compact(now=None):
+    """Принудительно удаляет устаревшие записи."""
+    path = db_path()
+    if path is None or not os.path.exists(path):
+        return
+    conn = _connect(path)
+    try:
+        _compact(conn, int(now if now is not None else time.time()))
+    finally:
+        conn.close()
+
+
+def _read(query, params=()):
+    """Выполняет выборку из истории; без базы возвращает пустой список."""
+    path = db_path()
+    if path is None or not os.path.exists(path):
+        return []
+    conn = _connect(path)
+    try:
+        return conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+
+def checks(since=0, limit=50):
+    """Последние проверки (новые первыми): время, исход, тайминги в мс и результаты по городам."""
+    rows = _read(
+        "SELECT c.ts, c.outcome, c.timings, group_concat(r.site_id || ':' || r.available) "
+        "FROM checks c LEFT JOIN results r ON r.check_id = c.id "
+        "WHERE c.ts >= ? GROUP BY c.id ORDER BY c.ts DESC LIMIT ?",
+        (since, limit),
+    )
+    result = []
+    for ts, outcome, timings, sites in rows:
+        pairs = [pair.split(":") for pair in sites.split(",")] if sites else []
+        result.append({
+            "ts": ts,
+            "outcome": outcome,
+            "timings_ms": json.loads(timings) if timings else {},
+            "sites": {site: available == "1" for site, available in pairs},
+        })
+    return result
+
+
+def windows(site_id=None, since=0):
+    """
+    Окна наличия мест (старые первыми). Длительность окна лежит между
+    seen_s (от первой до последней проверки с местами) и max_s (до первой проверки без мест).
+    """
+    query = "SELECT site_id, started_at, last_seen_at, closed_at, checks FROM windows WHERE last_seen_at >= ?"
+    params = [since]
+    if site_id is not None:
+        query += " AND site_id = ?"
+        params.append(int(site_id))
+    return [
+        {
+            "site_id": site,
+            "started_at": started_at,
+            "last_seen_at": last_seen_at,
+            "closed_at": closed_at,
+            "checks": count,
+            "seen_s": last_seen_at - started_at,
+            "max_s": closed_at - started_at if closed_at is not None else None,
+        }
+        for site, started_at, last_seen_at, closed_at, count in _read(query + " ORDER BY started_at", params)
+    ]
+
+
+def summary(since=0):
+    """Сводка за период: исходы проверок, медианы этапов и длительность окон наличия мест."""
+    outcomes = dict(_read("SELECT outcome, count(*) FROM checks WHERE ts >= ? GROUP BY outcome", (since,)))
+    phases = {}
+    for (timings,) in _read("SELECT timings FROM checks WHERE ts >= ? AND timings IS NOT NULL", (since,)):
+        for phase, ms in json.loads(timings).items():
+            phases.setdefault(phase, []).append(ms)
+    closed = [w for w in windows(since=since) if w["max_s"] is not None]
+    return {
+        "checks": sum(outcomes.values()),
+        "outcomes": outcomes,
+        "phase_median_ms": {phase: statistics.median(values) for phase, values in sorted(phases.items())},
+        "windows": len(closed),
+        # Чтобы не пропускать окна, интервал проверки должен быть заметно короче самого короткого окна
+        "window_min_s": min((w["max_s"] for w in closed), default=None),
+        "window_median_s": statistics.median([w["max_s"] for w in closed]) if closed else None,
+    }
+
+
+def _format_ts(ts):
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts is not None else "-"
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "еще открыто"
+    return f"{seconds // 3600}ч {seconds % 3600 // 60:02d}м {seconds % 60:02d}с"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="История проверок Almaviva")
+    parser.add_argument("--days", type=float, default=30, help="за сколько последних дней (по умолчанию 30)")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("summary", help="сводка по исходам, этапам и окнам наличия мест")
+    windows_parser = commands.add_parser("windows", help="когда появлялись места и сколько держались")
+    windows_parser.add_argument("--site", type=int, help="идентификатор города")
+    checks_parser = commands.add_parser("checks", help="последние проверки")
+    checks_parser.add_argument("--limit", type=int, default=50)
+    commands.add_parser("compact", help="удалить записи старше срока хранения")
+    args = parser.parse_args(argv)
+
+    if db_path() is None:
+        print("История отключена (HISTORY_DB=off)", file=sys.stderr)
+        return 1
+    since = int(time.time() - args.days * 86400)
+    if args.command == "compact":
+        compact()
+        return 0
+    if args.command == "summary":
+        result = summary(since)
+    elif args.command == "windows":
+        result = windows(args.site, since)
+    else:
+        result = checks(since, args.limit)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+
+    if args.command == "summary":
+        print(f"Проверок: {result['checks']}")
+        for outcome, count in sorted(result["outcomes"].items(), key=lambda item: -item[1]):
+            print(f"  {outcome:<14} {count}")
+        print("Медиана этапов:")
+        for phase, ms in result["phase_median_ms"].items():
+            print(f"  {phase:<14} {ms:g} мс")
+        print(f"Закрытых окон наличия мест: {result['windows']}")
+        if result["windows"]:
+            print(f"  самое короткое: {_format_duration(result['window_min_s'])}, "
+                  f"медиана: {_format_duration(round(result['window_median_s']))}")
+    elif args.command == "windows":
+        for w in result:
+            print(f"г. {w['site_id']:<3} {_format_ts(w['started_at'])} - {_format_ts(w['closed_at'])}  "
+                  f"{_format_duration(w['max_s'])} (проверок с местами: {w['checks']})")
+    else:
+        for c in result:
+            sites = ", ".join(f"{site}:{'да' if available else 'нет'}" for site, available in c["sites"].items())
+            total = c["timings_ms"].get("check")
+            print(f"{_format_ts(c['ts'])}  {c['outcome']:<14} {f'{total} мс' if total is not None else '-':>10}  {sites}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
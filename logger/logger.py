@@ -3,16 +3,33 @@
 Модуль логирования.
 Содержит:
 - Функцию log для вывода сообщений разных уровней с цветовой маркировкой
-- Вспомогательные функции info, warning, error для каждого уровня
-- Функцию telegram для отправки одиночного сообщения в Telegram
+- Вспомогательные функции debug, info, warning, error для каждого уровня
+- Функцию telegram для отправки одиночного сообщения в Telegram через фоновую очередь
+- Функцию configure_telegram, которая задает токен бота и чат из настроек
+
+Логирование построено на стандартном модуле logging и настраивается переменными окружения:
+- LOG_LEVEL: минимальный уровень сообщений (DEBUG, INFO, WARNING, ERROR), по умолчанию INFO
+- LOG_FORMAT: text (цветной вывод в консоль, по умолчанию) или json (JSON lines)
+- LOG_FILE: путь к файлу лога; если задан, лог дополнительно пишется в файл с ротацией
+- LOG_MAX_BYTES, LOG_BACKUP_COUNT: размер одного файла лога и количество хранимых архивов
+
+Сообщения форматируются лениво: info("Ответ %s", value) собирает строку только если уровень включен.
+Запись выполняется в отдельном потоке через очередь, поэтому вызов log не блокируется на выводе.
+Токены авторизации и ключи в сообщениях маскируются.
+
+Сообщения в Telegram отправляет отдельный поток с общим HTTP-соединением: при ответе 429
+он ждет retry_after, при сетевых ошибках и ответах 5xx повторяет отправку с нарастающей паузой.
 """
 
-import io
+import atexit
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import re
+import threading
 import time
-from datetime import datetime
-
-import requests
 
 # ANSI-код для сброса цвета вывода
 RESET = "\033[0m"
@@ -24,15 +41,125 @@ COLORS = {
     "ERROR": "\033[31m",  # Red
 }
 
+# Шаблоны секретов, которые нельзя выводить в лог: Bearer-токены, JWT и токены Telegram-ботов
+SECRET_PATTERNS = [
+    re.compile(r"(Bearer\s+)[\w\-.~+/=]+", re.IGNORECASE),
+    re.compile(r"()eyJ[\w-]+\.[\w-]+\.[\w-]+"),
+    re.compile(r"(/bot)\d+:[\w-]+"),
+]
+
+# Адрес Bot API (TELEGRAM_API_URL позволяет подменить его локальной заглушкой)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+# Таймаут HTTP-запроса к Telegram и количество попыток отправки одного сообщения
+TELEGRAM_TIMEOUT = 10
+TELEGRAM_ATTEMPTS = 5
+# Максимум неотправленных сообщений в очереди, при переполнении новые сообщения отбрасываются
+TELEGRAM_QUEUE_SIZE = 100
+
+_logger = logging.getLogger("almaviva")
+_listener = None
+_setup_lock = threading.Lock()
+
+_telegram_queue = queue.Queue(maxsize=TELEGRAM_QUEUE_SIZE)
+_telegram_thread = None
+# Токен бота и чат из настроек; пока они не заданы, берутся из окружения
+_telegram_bot_token = None
+_telegram_chat_id = None
+
+
+def _redact(text):
+    """Маскирует секреты в строке."""
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(r"\1***", text)
+    return text
+
+
+class _RedactingFilter(logging.Filter):
+    """Фильтр, который маскирует секреты в итоговом тексте сообщения."""
+
+    def filter(self, record):
+        record.msg = _redact(record.getMessage())
+        record.args = None
+        return True
+
+
+class _ColorFormatter(logging.Formatter):
+    """Цветной вывод в консоль: время, уровень и сообщение."""
+
+    def format(self, record):
+        ts = time.strftime("%H:%M:%S", time.localtime(record.created))
+        color = COLORS.get(record.levelname, "")
+        return f"{color}{ts} {record.levelname}: {record.getMessage()}{RESET}"
+
+
+class _JsonFormatter(logging.Formatter):
+    """Вывод в формате JSON lines: одна запись — одна строка."""
+
+    def format(self, record):
+        return json.dumps(
+            {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "msg": record.getMessage(),
+            },
+            ensure_ascii=False,
+        )
+
+
+def _setup():
+    """Настраивает логгер по переменным окружения при первом использовании."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter = _JsonFormatter() if os.getenv("LOG_FORMAT") == "json" else _ColorFormatter()
+
+        console = logging.StreamHandler()
+        console.setFormatter(formatter)
+        handlers = [console]
+
+        log_file = os.getenv("LOG_FILE")
+        if log_file:
+            # В файл цвета не пишем: либо JSON lines, либо обычный текст
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+                backupCount=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+                encoding="utf-8",
+            )
+            file_handler.setFormatter(
+                formatter if isinstance(formatter, _JsonFormatter)
+                else logging.Formatter("%(asctime)s %(levelname)s: %(message)s")
+            )
+            handlers.append(file_handler)
+
+        # Вызывающий поток только кладет запись в очередь, вывод выполняет отдельный поток
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(_RedactingFilter())
+        _logger.addHandler(queue_handler)
+        level = os.getenv("LOG_LEVEL", "INFO").upper()
+        _logger.setLevel(level if level in COLORS else "INFO")
+        _logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers)
+        _listener.start()
+        # Дописываем оставшиеся в очереди сообщения при завершении скрипта
+        atexit.register(_listener.stop)
+
 
 # Основная функция логирования с учётом уровня, цвета и метки времени
 def log(level, msg, *args, **kwargs):
     """Generic log with timestamp, level, and color."""
-    # Формируем строку текущего времени
-    ts = time.strftime("%H:%M:%S")
-    color = COLORS.get(level, "")
-    # Выводим сообщение в консоль с цветом
-    print(f"{color}{ts} {level}: {msg}{RESET}", *args, **kwargs)
+    if _listener is None:
+        _setup()
+    _logger.log(logging.getLevelName(level), msg, *args, **kwargs)
+
+
+# Логирование уровня DEBUG
+def debug(msg, *args, **kwargs):
+    """Debug-level log."""
+    log("DEBUG", msg, *args, **kwargs)
 
 
 # Логирование уровня INFO
@@ -53,16 +180,76 @@ def error(msg, *args, **kwargs):
     log("ERROR", msg, *args, **kwargs)
 
 
+# Отправка одного сообщения в Telegram с повторами
+def _send_telegram(session, text):
+    url = f"{TELEGRAM_API_URL}/bot{_telegram_bot_token or os.getenv("TELEGRAM_BOT_TOKEN")}/sendMessage"
+    payload = {"chat_id": _telegram_chat_id or os.getenv("TELEGRAM_CHAT_ID"), "text": text}
+    delay = 1
+    for _ in range(TELEGRAM_ATTEMPTS):
+        try:
+            r = session.post(url, data=payload, timeout=TELEGRAM_TIMEOUT)
+            # Превышен лимит сообщений — ждем столько, сколько просит Telegram
+            if r.status_code == 429:
+                retry_after = r.json().get("parameters", {}).get("retry_after", delay)
+                warning("Telegram ограничил частоту сообщений, повтор через %s с", retry_after)
+                time.sleep(retry_after)
+                continue
+            if r.status_code >= 500:
+                raise Exception(f"Telegram вернул HTTP {r.status_code}")
+            # Остальные ошибки (неверный токен, чат) повтором не исправить
+            if not r.ok:
+                error("Telegram отклонил сообщение: HTTP %s %s", r.status_code, r.text)
+            return
+        except Exception as e:
+            warning("Не удалось отправить сообщение в Telegram - %s, повтор через %s с", e, delay)
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+    error("Сообщение в Telegram не отправлено за %s попыток", TELEGRAM_ATTEMPTS)
+
+
+# Фоновый поток отправки сообщений в Telegram через одно HTTP-соединение
+def _telegram_worker():
+    # requests загружается только при первой отправке, а не при старте скрипта
+    import requests
+
+    session = requests.Session()
+    while True:
+        text = _telegram_queue.get()
+        if text is None:
+            break
+        _send_telegram(session, text)
+    session.close()
+
+
+# Завершение фонового потока с отправкой оставшихся сообщений
+def _stop_telegram(timeout=30):
+    _telegram_queue.put(None)
+    _telegram_thread.join(timeout)
+
+
+# Настройка получателя сообщений в Telegram
+def configure_telegram(bot_token, chat_id):
+    """Задает токен бота и чат, в который отправляются сообщения."""
+    global _telegram_bot_token, _telegram_chat_id
+    _telegram_bot_token = bot_token
+    _telegram_chat_id = chat_id
+
+
 # Публичная функция для отправки одиночного сообщения через Telegram-бота
 def telegram(msg: str, *args, **kwargs):
-    """Public function to send a single message via the 'public' Telegram bot."""
+    """Public function to queue a single message for the 'public' Telegram bot."""
+    global _telegram_thread
     text = msg.format(*args, **kwargs) if (args or kwargs) else msg
 
-    url = f"https://api.telegram.org/bot{os.getenv("TELEGRAM_BOT_TOKEN")}/sendMessage"
-    payload = {"chat_id": os.getenv("TELEGRAM_CHAT_ID"), "text": text}
+    with _setup_lock:
+        if _telegram_thread is None:
+            _telegram_thread = threading.Thread(target=_telegram_worker, name="telegram-sender", daemon=True)
+            _telegram_thread.start()
+            # Дожидаемся отправки очереди при завершении скрипта, но не дольше таймаута
+            atexit.register(_stop_telegram)
 
+    # Не блокируем проверку: сообщение отправит фоновый поток
     try:
-        requests.post(url, data=payload)
-    except Exception as e:
-        error(e)
-        pass
\ No newline at end of file
+        _telegram_queue.put_nowait(text)
+    except queue.Full:
+        error("Очередь сообщений в Telegram переполнена, сообщение отброшено")
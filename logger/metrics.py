@@ -0,0 +1,181 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Модуль метрик проверки.
+Содержит:
+- Контекстный менеджер span для замера длительности этапа проверки
+- Функцию count для подсчета исходов проверок
+- Функцию set_gauge для текущих значений (например, памяти браузера)
+- Функции begin_check и end_check, которые собирают тайминги этапов одной проверки
+  (end_check перезаписывает файл метрик, поэтому исход проверки учитывается до него)
+- Функцию write_textfile, которая перезаписывает файл метрик (для проверок без таймингов, например пропущенных)
+- Функцию render, которая отдает метрики в текстовом формате Prometheus
+- Функцию start, которая по переменным окружения включает экспорт метрик
+
+Экспорт включается явно:
+- METRICS_PORT: локальный HTTP-эндпоинт http://127.0.0.1:<порт>/metrics
+- METRICS_TEXTFILE: файл для textfile-коллектора node_exporter, перезаписывается после каждой проверки
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from logger.logger import info, warning
+
+# Границы корзин гистограммы длительности этапов в секундах
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Исходы проверки
+AVAILABLE = "available"
+UNAVAILABLE = "unavailable"
+BLOCKED = "blocked"
+LOGIN_FAILURE = "login_failure"
+CDP_ERROR = "cdp_error"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+ERROR = "error"
+
+_lock = threading.Lock()
+# Гистограммы длительности этапов: этап -> [счетчики по корзинам, сумма, количество]
+_histograms = {}
+# Счетчики исходов проверок
+_counters = {}
+# Текущие значения: имя -> значение
+_gauges = {}
+# Тайминги этапов текущей и последней завершенной проверки
+_current = {}
+_last = {}
+_last_check_at = None
+
+
+def observe(phase, seconds):
+    """Записывает длительность этапа."""
+    with _lock:
+        hist = _histograms.setdefault(phase, [[0] * len(BUCKETS), 0.0, 0])
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[0][i] += 1
+        hist[1] += seconds
+        hist[2] += 1
+        _current[phase] = _current.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def span(phase):
+    """Замеряет длительность блока кода как этап phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - start)
+
+
+def count(outcome):
+    """Увеличивает счетчик исхода проверки."""
+    with _lock:
+        _counters[outcome] = _counters.get(outcome, 0) + 1
+
+
+def set_gauge(name, value):
+    """Запоминает текущее значение метрики name (экспортируется как almaviva_<name>)."""
+    with _lock:
+        _gauges[name] = value
+
+
+def begin_check():
+    """Начинает сбор таймингов новой проверки."""
+    with _lock:
+        _current.clear()
+
+
+def end_check():
+    """Завершает проверку и возвращает тайминги ее этапов в секундах."""
+    global _last_check_at
+    with _lock:
+        _last.clear()
+        _last.update(_current)
+        _last_check_at = time.time()
+        timings = dict(_last)
+    write_textfile()
+    return timings
+
+
+def last_timings():
+    """Возвращает тайминги этапов последней завершенной проверки."""
+    with _lock:
+        return dict(_last)
+
+
+def render():
+    """Возвращает все метрики в текстовом формате Prometheus."""
+    lines = []
+    with _lock:
+        lines.append("# HELP almaviva_phase_duration_seconds Duration of check phases.")
+        lines.append("# TYPE almaviva_phase_duration_seconds histogram")
+        for phase, (buckets, total, n) in sorted(_histograms.items()):
+            for bound, value in zip(BUCKETS, buckets):
+                lines.append(f'almaviva_phase_duration_seconds_bucket{{phase="{phase}",le="{bound}"}} {value}')
+            lines.append(f'almaviva_phase_duration_seconds_bucket{{phase="{phase}",le="+Inf"}} {n}')
+            lines.append(f'almaviva_phase_duration_seconds_sum{{phase="{phase}"}} {total:.6f}')
+            lines.append(f'almaviva_phase_duration_seconds_count{{phase="{phase}"}} {n}')
+        lines.append("# HELP almaviva_checks_total Completed checks by outcome.")
+        lines.append("# TYPE almaviva_checks_total counter")
+        for outcome, value in sorted(_counters.items()):
+            lines.append(f'almaviva_checks_total{{outcome="{outcome}"}} {value}')
+        if _last_check_at is not None:
+            lines.append("# HELP almaviva_last_check_timestamp_seconds Time of the last finished check.")
+            lines.append("# TYPE almaviva_last_check_timestamp_seconds gauge")
+            lines.append(f"almaviva_last_check_timestamp_seconds {_last_check_at:.3f}")
+        for name, value in sorted(_gauges.items()):
+            lines.append(f"# TYPE almaviva_{name} gauge")
+            lines.append(f"almaviva_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile():
+    """Перезаписывает файл метрик для textfile-коллектора, если он задан."""
+    path = os.getenv("METRICS_TEXTFILE")
+    if not path:
+        return
+    # Пишем во временный файл и подменяем им основной, чтобы коллектор не прочитал файл наполовину
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(render())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        warning("Не удалось записать файл метрик - %s", e)
+
+
+def start():
+    """Запускает экспорт метрик, если он включен переменными окружения."""
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    # HTTP-сервер загружается только если эндпоинт включен
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        """Обработчик HTTP-запросов к эндпоинту метрик."""
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Не пишем каждый запрос сборщика метрик в лог
+            pass
+
+    # Эндпоинт слушает только локальный интерфейс
+    server = ThreadingHTTPServer(("127.0.0.1", int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    info("Метрики доступны по адресу http://127.0.0.1:%s/metrics", port)
+    return server
@@ -2,34 +2,118 @@
 Точка входа в скрипт.
 
 Этот модуль:
-- Заполняет переменные окружения значениями по умолчанию.
-- Настраивает периодический запуск задачи из ScheduleManager.
-- Запускает главный цикл, который выполняет запланированные задачи.
+- Собирает и проверяет настройки из env_config.json, переменных окружения и аргументов командной строки;
+  если ввод с терминала, предлагает заполнить или изменить сохраненные значения.
+- Запускает цикл ScheduleManager, который выполняет проверки по расписанию
+  и применяет изменения env_config.json без перезапуска.
+- Включает локальный API управления, если задан CONTROL_PORT.
+- Останавливает резидентный Chrome при завершении скрипта (в том числе по SIGTERM/SIGINT).
+- С флагом --once выполняет одну проверку без вопросов и завершается с кодом,
+  который отражает ее исход (для cron и таймеров systemd).
+
+Менеджеры, сетевые библиотеки и клиент CDP импортируются только после проверки настроек,
+поэтому ошибка конфигурации и --help не ждут их загрузки.
 """
 
 #  Copyright Feliks Zubarev (c) 2025.
 
-import time
+import argparse
+import sys
+
+from logger import metrics
+from logger.logger import configure_telegram, error
+from managers import settings as settings_loader
+from managers.settings import SettingsError
+
+# Коды завершения в режиме --once
+EXIT_UNAVAILABLE = 0
+EXIT_ERROR = 1
+EXIT_CONFIG_ERROR = 2
+EXIT_AVAILABLE = 10
+EXIT_BLOCKED = 11
+EXIT_LOGIN_FAILURE = 12
+EXIT_SKIPPED = 13
+EXIT_CODES = {
+    metrics.AVAILABLE: EXIT_AVAILABLE,
+    metrics.UNAVAILABLE: EXIT_UNAVAILABLE,
+    metrics.BLOCKED: EXIT_BLOCKED,
+    metrics.LOGIN_FAILURE: EXIT_LOGIN_FAILURE,
+    metrics.SKIPPED: EXIT_SKIPPED,
+}
+
+
+def parse_args(argv=None):
+    """Разбирает аргументы командной строки. Секреты задаются только через окружение или env_config.json."""
+    parser = argparse.ArgumentParser(description="Проверка визовых слотов Almaviva")
+    parser.add_argument("--once", action="store_true", help="выполнить одну проверку и завершиться")
+    parser.add_argument("--no-input", action="store_true", help="не задавать вопросов, даже если ввод с терминала")
+    parser.add_argument("--config", default=settings_loader.CONFIG_PATH, help="файл с сохраненными значениями")
+    parser.add_argument("--interval", help="интервал проверки в минутах (CHECK_INTERVAL)")
+    parser.add_argument("--city-id", help="идентификатор города (CITY_ID)")
+    parser.add_argument("--city-name", help="название города (CITY_NAME)")
+    parser.add_argument("--schedule-mode", choices=settings_loader.SCHEDULE_MODES, help="режим расписания (SCHEDULE_MODE)")
+    return parser.parse_args(argv)
+
+
+def cli_overrides(args):
+    """Значения настроек, заданные аргументами командной строки."""
+    overrides = {
+        "CHECK_INTERVAL": args.interval,
+        "CITY_ID": args.city_id,
+        "CITY_NAME": args.city_name,
+        "SCHEDULE_MODE": args.schedule_mode,
+    }
+    return {k: v for k, v in overrides.items() if v is not None}
+
+
+def load_settings(args):
+    """
+    Собирает настройки; интерактивное меню показывается только для постоянного режима с терминала.
+    Возвращает настройки и ключи, измененные в меню: меню сохраняет их в файл, и для них
+    значение из файла важнее переменных окружения (в том числе при перечитывании файла).
+    """
+    file_keys = frozenset()
+    if not args.once and not args.no_input and sys.stdin.isatty():
+        from managers.environment_manager import EnvironmentManager
+
+        # Значения, введенные в меню, важнее переменных окружения, но аргументы командной строки важнее всего
+        file_keys = frozenset(EnvironmentManager.fill_default_values(args.config))
+    settings = settings_loader.load(
+        cli_overrides(args), config_path=args.config, require_interval=not args.once, file_keys=file_keys
+    )
+    return settings, file_keys
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        settings, file_keys = load_settings(args)
+    except SettingsError as e:
+        error(f"Ошибка конфигурации: {e}")
+        return EXIT_CONFIG_ERROR
+    configure_telegram(settings.telegram_bot_token, settings.telegram_chat_id)
+
+    # Тяжелые модули (requests, websocket, клиент CDP) загружаются только с проверенными настройками
+    from managers.schedule_manager import ScheduleManager
+
+    if args.once:
+        # Прочие исходы (таймаут, ошибки CDP и общие ошибки) завершаются кодом ошибки
+        return EXIT_CODES.get(ScheduleManager.run_once(settings), EXIT_ERROR)
+
+    # Включаем экспорт метрик, если задан METRICS_PORT или METRICS_TEXTFILE
+    metrics.start()
+    # Включаем локальный API управления, если задан CONTROL_PORT
+    from managers import control_server
 
-import schedule
+    control_server.start()
 
-import os
+    # Изменения env_config.json применяются без перезапуска; аргументы командной строки остаются в силе,
+    # а для значений, измененных в меню, файл по-прежнему важнее переменных окружения
+    watcher = settings_loader.SettingsWatcher(settings, cli_overrides(args), args.config, file_keys=file_keys)
+    # Запускаем цикл расписания, который работает до получения SIGTERM/SIGINT
+    ScheduleManager.run_forever(settings, watcher)
+    return 0
 
-import logger.logger
-from managers.environment_manager import EnvironmentManager
-from managers.schedule_manager import ScheduleManager
 
 if __name__ == "__main__":
-    # Заполняем переменные окружения значениями по умолчанию, если они не заданы
-    EnvironmentManager.fill_default_values()
-
-    # Планируем выполнение задачи
-    time_interval = os.getenv("CHECK_INTERVAL")
-    schedule.every(int(time_interval)).minutes.do(ScheduleManager.job)
-
-    # Запускаем бесконечный цикл для обработки запланированных задач
-    while True:
-        schedule.run_pending()
-        # Проверяем, есть ли задачи, которые нужно выполнить в текущий момент
-        time.sleep(1)
-        # Ждём 1 секунду, чтобы не перегружать процессор
+    sys.exit(main())
@@ -4,67 +4,137 @@
 Содержит класс AlmavivaManager, который:
 - управляет запуском и завершением браузера;
 - устанавливает хуки и слушатели для Cloudflare и капчи;
-- выполняет логику входа, валидации OTP и проверки доступности слотов;
-- отправляет уведомление и завершает сессию.
+- выполняет логику входа, валидации OTP и проверки доступности слотов
+  (все города из настроек проверяются после одного входа);
+- пропускает ожидание капчи и вход, если сохраненная сессия еще действует;
+- отправляет одно общее уведомление по всем городам и завершает сессию;
+- прерывает проверку и закрывает вкладку, если она не уложилась в дедлайн (JOB_TIMEOUT).
 """
 
+import threading
+
+from logger import metrics
+from logger.logger import info, warning
 from services.almaviva_service import AlmavivaService, BASE_URL
 from services.captcha_service import CaptchaService
 from services.chrome_service import ChromeService
+from services.session_service import SessionService
 from services.telegram_service import TelegramService
 
 
+class JobTimeoutError(Exception):
+    """Проверка не уложилась в отведенное время и была прервана."""
+
+
 # Менеджер интеграции всех сервисов для проверки и уведомления
 class AlmavivaManager:
-    def __init__(self):
+    def __init__(self, devtools_url, settings):
+        self.settings = settings
         # Инициализация: создаем экземпляры всех сервисов
-        self.captcha_service = CaptchaService()
-        self.almaviva_service = AlmavivaService()
-        self.chrome_service = ChromeService()
+        self.captcha_service = CaptchaService(
+            settings.captcha_api_key, settings.captcha_timeout, settings.captcha_poll_interval
+        )
+        self.almaviva_service = AlmavivaService(settings)
+        # Сервис Chrome подключается к уже запущенному браузеру по адресу его отладчика
+        self.chrome_service = ChromeService(devtools_url)
         self.telegram_service = TelegramService()
+        # Режим уведомлений и результат последнего сообщения, сохраненный предыдущими запусками
+        TelegramService.configure(settings)
+        # Состояние сессии, сохраненное предыдущими запусками
+        self.session_service = SessionService(settings.city_id)
+        # Событие выставляется, когда проверка прервана по дедлайну
+        self.timed_out = threading.Event()
+        # Результаты последней проверки по городам: {название города: есть ли места}
+        self.results = {}
+
+    def _on_deadline(self):
+        """Дедлайн проверки: прерываем ожидания и закрываем вкладку, чтобы основной поток освободился."""
+        self.timed_out.set()
+        warning(f"Проверка не уложилась в {self.settings.job_timeout:g} с, прерываем")
+        self.captcha_service.cancel()
+        self.almaviva_service.cancel()
+        self.chrome_service.abort()
 
     def run(self):
+        """
+        Выполняет одну проверку мест по всем городам и возвращает True, если места есть хотя бы в одном.
+        Длительность каждого этапа записывается в метрики.
+        Если проверка длится дольше JOB_TIMEOUT, она прерывается с JobTimeoutError.
+        """
+        # Таймер дедлайна срабатывает в отдельном потоке, пока основной поток ждет Chrome или сеть
+        deadline = threading.Timer(self.settings.job_timeout, self._on_deadline)
+        deadline.daemon = True
+        deadline.start()
         try:
             # Подключаемся к браузеру Chrome через CDP
-            self.chrome_service.connect()
-            # Добавляем слушатель запросов для автоматического обновления заголовков
-            self.almaviva_service.add_headers_listener(self.chrome_service.tab)
-            # Внедряем JS-хук для перехвата параметров капчи и Cloudflare
-            self.captcha_service.inject_hook(self.chrome_service.tab)
+            with metrics.span("connect"):
+                self.chrome_service.connect()
+                # Добавляем слушатель запросов для автоматического обновления заголовков
+                self.almaviva_service.add_headers_listener(self.chrome_service.tab)
+                # Устанавливаем JS-хелпер для запросов к API на каждый документ
+                self.almaviva_service.install_fetch_helper(self.chrome_service.tab)
+                # Внедряем JS-хук для перехвата параметров капчи и Cloudflare
+                self.captcha_service.inject_hook(self.chrome_service.tab)
             # Открываем главную страницу визового центра
-            self.chrome_service.open_main_page()
+            with metrics.span("navigate"):
+                self.chrome_service.open_main_page()
 
             # Проверяем, не заблокирован ли доступ от Cloudflare
-            self.chrome_service.check_if_blocked()
-
-            # Проверяем наличие Turnstile-капчи на странице
-            if self.captcha_service.is_turnstile_available():
-                # Решаем капчу с помощью сервиса 2captcha
-                captcha_token = self.captcha_service.solve_turnstile(BASE_URL)
-                # Внедряем полученный капча-токен в страницу
-                self.chrome_service.inject_captcha_token(captcha_token)
+            with metrics.span("block_check"):
+                self.chrome_service.check_if_blocked()
 
-            # Получаем текущий токен авторизации из куки браузера
-            token = self.chrome_service.check_current_login()
-            if token:
-                # Сохраняем найденный валидный токен в сервисе Almaviva
-                self.almaviva_service.token = token
-            # Если токен не найден, выполняем полный вход в учетную запись
+            # Если допуск Cloudflare и токен еще действуют, идем по быстрому пути
+            fast_path = self.session_service.is_valid()
+            if fast_path:
+                info("Сохраненная сессия действует, пропускаем ожидание капчи и вход")
             else:
-                # Выполняем запрос авторизации через API Almaviva
-                login_data = self.almaviva_service.login(self.chrome_service.tab)
-                # Инъекция полученных куки в браузер для сессии
-                self.chrome_service.inject_cookies(login_data)
+                with metrics.span("challenge"):
+                    # Проверяем наличие Turnstile-капчи на странице
+                    if self.captcha_service.is_turnstile_available():
+                        # Решаем капчу с помощью сервиса 2captcha
+                        captcha_token = self.captcha_service.solve_turnstile(BASE_URL)
+                        # Внедряем полученный капча-токен в страницу
+                        self.chrome_service.inject_captcha_token(captcha_token)
+
+            with metrics.span("login"):
+                # Получаем текущий токен авторизации из куки браузера
+                token = self.chrome_service.check_current_login()
+                if token:
+                    # Сохраняем найденный валидный токен в сервисе Almaviva
+                    self.almaviva_service.token = token
+                # Если токен не найден, выполняем полный вход в учетную запись
+                else:
+                    # Выполняем запрос авторизации через API Almaviva
+                    login_data = self.almaviva_service.login(self.chrome_service.tab)
+                    # Инъекция полученных куки в браузер для сессии
+                    self.chrome_service.inject_cookies(login_data)
 
-            # Проверяем доступность визовых слотов на сайте
-            is_available = self.almaviva_service.check_availability(
-                self.chrome_service.tab
-            )
-            # Отправляем уведомление о результате проверки
-            self.telegram_service.send_telegram_message(is_available)
+            # Проверяем доступность визовых слотов на сайте по всем городам
+            try:
+                with metrics.span("availability"):
+                    self.results = self.almaviva_service.check_cities(self.chrome_service.tab)
+            except Exception:
+                # Сохраненная сессия оказалась недействительной — в следующий раз идем полным путем
+                self.session_service.invalidate()
+                raise
+            # Запоминаем сроки действия допуска и токена для следующих запусков
+            if not fast_path:
+                self.session_service.update(
+                    self.chrome_service.get_clearance_expiry(),
+                    self.chrome_service.get_token_expiry(self.almaviva_service.token),
+                )
+            # Отправляем одно уведомление о результатах по всем городам
+            with metrics.span("notify"):
+                self.telegram_service.send_telegram_message(self.results)
             # Завершаем сессию браузера и CDP
             self.chrome_service.finish()
+            return any(self.results.values())
         except Exception as e:
             # При ошибке завершаем сессию перед пробросом исключения
             self.chrome_service.finish()
+            # Ошибка, вызванная прерыванием по дедлайну, заменяется понятной причиной
+            if self.timed_out.is_set():
+                raise JobTimeoutError(f"Проверка не уложилась в {self.settings.job_timeout:g} с") from e
             raise e
+        finally:
+            deadline.cancel()
@@ -3,20 +3,76 @@
 """
 Модуль для управления процессом Chrome.
 Содержит класс ChromeManager, который:
-- запускает Chrome с remote-debugging портом и пользовательским профилем
+- находит исполняемый файл Chrome/Chromium на macOS и Linux (или берет его из CHROME_PATH)
+- запускает Chrome со свободным remote-debugging портом, пользовательским профилем
+  и облегченным профилем запуска (CHROME_LAUNCH_PROFILE)
+- определяет порт отладчика по файлу DevToolsActivePort в профиле
 - при необходимости добавляет прокси-конфигурацию через Squid;
 - ожидает готовности DevTools Protocol
-- корректно завершает процесс
+- проверяет, что запущенный браузер жив и отвечает, и при необходимости перезапускает его
+- перезапускает браузер, если его процессы заняли слишком много памяти
+  или профиль вырос больше лимита
+- перед каждым запуском чистит профиль от ненужных для проверки кэшей (ProfileManager)
+- запускает Chrome в отдельной группе процессов и завершает всю группу (рендереры, GPU и служебные процессы)
+- перед запуском завершает Chrome, который остался от аварийно завершенного скрипта и держит профиль
+  (по ссылке SingletonLock в профиле)
 """
 
 import os
+import shlex
+import shutil
+import signal
+import socket
 import subprocess
+import sys
 import time
 from subprocess import DEVNULL
 
 import requests
 
-from logger.logger import info
+from logger import metrics
+from logger.logger import info, warning
+from managers.process_tree import tree_rss
+from managers.profile_manager import ProfileManager
+
+# Путь к исполняемому файлу Chrome; если не задан, браузер ищется автоматически
+CHROME_PATH = os.getenv("CHROME_PATH")
+# Путь к Chrome на macOS
+MACOS_CHROME_PATH = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+# Имена исполняемых файлов Chrome и Chromium на Linux в порядке приоритета
+LINUX_CHROME_NAMES = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome")
+# Профили запуска: standard — как обычный браузер, lean — без фоновых служб и с ограничением ресурсов
+CHROME_LAUNCH_PROFILE = os.getenv("CHROME_LAUNCH_PROFILE", "lean")
+# Максимальный размер дискового кэша в мегабайтах для профиля lean
+CHROME_DISK_CACHE_MB = int(os.getenv("CHROME_DISK_CACHE_MB", "64"))
+LEAN_ARGS = [
+    # Фоновые запросы, обновления компонентов и отчеты не нужны для одной проверки
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-domain-reliability",
+    "--disable-client-side-phishing-detection",
+    "--disable-breakpad",
+    "--metrics-recording-only",
+    "--no-pings",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+    # Без GPU-процесса и с ограниченным количеством процессов рендеринга
+    "--disable-gpu",
+    "--renderer-process-limit=2",
+    "--mute-audio",
+    f"--disk-cache-size={CHROME_DISK_CACHE_MB * 1024 * 1024}",
+]
+# Дополнительные аргументы запуска Chrome, например "--headless=new" для серверов без дисплея
+CHROME_EXTRA_ARGS = shlex.split(os.getenv("CHROME_EXTRA_ARGS", ""))
+# Максимальное время ожидания запуска локального отладчика в секундах
+DEVTOOLS_START_TIMEOUT = 15
+# Время ожидания завершения Chrome после SIGTERM, после которого группа завершается SIGKILL
+STOP_TIMEOUT = 10
+# Порог памяти, после которого резидентный браузер перезапускается (0 отключает проверку):
+# суммарный RSS всех процессов Chrome (только Linux)
+CHROME_MAX_RSS_MB = int(os.getenv("CHROME_MAX_RSS_MB", "1024"))
+# Размер профиля, после которого резидентный браузер перезапускается, чтобы почистить профиль (0 отключает)
+CHROME_MAX_PROFILE_MB = int(os.getenv("CHROME_MAX_PROFILE_MB", "512"))
 
 # Менеджер процесса Chrome: отвечает за запуск и остановку браузера Chrome
 class ChromeManager:
@@ -24,63 +80,236 @@ class ChromeManager:
     Менеджер для управления процессом Chrome.
     """
 
-    def __init__(self):
+    def __init__(self, city_id):
         # Инициализация: процесс Chrome пока не создан
         self.process = None
-        self.city_id = os.getenv("CITY_ID")
+        self.city_id = city_id
+        # Порт локального отладчика, выбранный самим Chrome при запуске
+        self.port = None
+        # Путь к профилю Chrome
+        self.profile_dir = os.path.expanduser('~') + f'/almaviva-chrome-profiles/city-{self.city_id}'
+        self.profile = ProfileManager(self.profile_dir)
+
+    @property
+    def devtools_url(self):
+        """
+        Адрес HTTP-эндпоинта локального отладчика Chrome.
+        """
+        return f"http://127.0.0.1:{self.port}"
+
+    @staticmethod
+    def find_chrome():
+        """
+        Возвращает путь к исполняемому файлу Chrome или Chromium для текущей платформы.
+        """
+        if CHROME_PATH:
+            return CHROME_PATH
+        if sys.platform == "darwin":
+            return MACOS_CHROME_PATH
+        # На Linux ищем браузер в PATH
+        for name in LINUX_CHROME_NAMES:
+            path = shutil.which(name)
+            if path:
+                return path
+        raise Exception("Chrome не найден, укажите путь к нему в переменной окружения CHROME_PATH")
+
+    def _wait_for_devtools_port(self, port_file):
+        """
+        Ожидает появления файла DevToolsActivePort и возвращает записанный в него порт.
+        """
+        deadline = time.monotonic() + DEVTOOLS_START_TIMEOUT
+        # Короткая пауза с экспоненциальным ростом: 10 мс, 20 мс, ... но не больше 200 мс
+        delay = 0.01
+        while time.monotonic() < deadline:
+            # Chrome завершился, не успев открыть отладчик
+            if self.process.poll() is not None:
+                return None
+            try:
+                with open(port_file, "r", encoding="utf-8") as f:
+                    first_line = f.readline().strip()
+                # Файл мог быть прочитан до окончания записи — ждем, пока появится порт
+                if first_line.isdigit():
+                    return int(first_line)
+            except FileNotFoundError:
+                pass
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+        return None
+
+    @staticmethod
+    def _process_cmdline(pid):
+        """
+        Возвращает командную строку процесса или None, если процесса нет.
+        """
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                return f.read().replace(b"\0", b" ").decode(errors="replace")
+        except FileNotFoundError:
+            # Процесса нет или нет /proc (macOS) — спрашиваем ps
+            if os.path.exists("/proc"):
+                return None
+        except OSError:
+            return None
+        result = subprocess.run(["ps", "-o", "command=", "-p", str(pid)], capture_output=True, text=True)
+        return result.stdout.strip() or None
+
+    def _kill_orphan(self):
+        """
+        Завершает Chrome, который остался от прошлого запуска скрипта и все еще держит профиль.
+        Такой браузер пережил бы падение скрипта (он запущен в своей сессии), а новый Chrome
+        с тем же профилем передал бы ему управление и сразу завершился.
+        """
+        try:
+            # Chrome держит профиль ссылкой SingletonLock вида "<хост>-<pid>"
+            host, _, pid = os.readlink(os.path.join(self.profile_dir, "SingletonLock")).rpartition("-")
+        except OSError:
+            return
+        if host != socket.gethostname() or not pid.isdigit():
+            return
+        pid = int(pid)
+        # PID мог достаться другому процессу — завершаем только Chrome с этим профилем
+        cmdline = self._process_cmdline(pid)
+        if not cmdline or f"--user-data-dir={self.profile_dir}" not in cmdline:
+            return
+        warning(f"Профиль занят Chrome от прошлого запуска (pid {pid}), завершаем его")
+        try:
+            # Прошлый Chrome запускался в своей сессии, поэтому его группа совпадает с его pid
+            group = os.getpgid(pid)
+            kill = os.killpg if group == pid else os.kill
+            kill(pid, signal.SIGTERM)
+            deadline = time.monotonic() + STOP_TIMEOUT
+            while time.monotonic() < deadline and self._process_cmdline(pid):
+                time.sleep(0.1)
+            # Добиваем группу, если браузер не завершился или его дочерние процессы пережили его
+            kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        # Владелец блокировки завершен — убираем ее, чтобы новый Chrome не пытался передать ему управление
+        for name in ("SingletonLock", "SingletonSocket", "SingletonCookie"):
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except OSError:
+                pass
 
     def start(self):
         """
         Запускает процесс Chrome.
         """
-        # Определяем путь к профилю Chrome
-        profile_dir = os.path.expanduser('~') + f'/almaviva-chrome-profiles/city-{self.city_id}'
+        profile_dir = self.profile_dir
         # Если директории профиля нет, создаём её пустой
         if not os.path.exists(profile_dir):
             os.makedirs(profile_dir, exist_ok=True)
+        # Браузер, оставшийся от упавшего скрипта, держит профиль — завершаем его до чистки и запуска
+        self._kill_orphan()
+        # Пока браузер не запущен, чистим профиль от кэшей, которые не ускоряют проверку
+        self.profile.maintain()
+        # Удаляем файл с портом от предыдущего запуска, чтобы не подключиться к устаревшему порту
+        port_file = os.path.join(profile_dir, "DevToolsActivePort")
+        if os.path.exists(port_file):
+            os.remove(port_file)
 
         cmd = [
-            "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
-            "--remote-debugging-port=9222",
+            self.find_chrome(),
+            # Порт 0 — Chrome сам выбирает свободный порт и записывает его в DevToolsActivePort
+            "--remote-debugging-port=0",
             f"--user-data-dir={profile_dir}",
             "--no-first-run",
             "--no-default-browser-check",
             "--disable-extensions",
-            "--disable-sync"
+            "--disable-sync",
+            *(LEAN_ARGS if CHROME_LAUNCH_PROFILE == "lean" else []),
+            *CHROME_EXTRA_ARGS,
         ]
-        # Запускаем процесс Chrome
-        self.process = subprocess.Popen(cmd, stdout=DEVNULL, stderr=DEVNULL)
+        # Запускаем процесс Chrome в новой сессии: его группа процессов включает все дочерние процессы
+        self.process = subprocess.Popen(cmd, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
         # Логируем запуск и начинаем ожидание DevTools Protocol
         info("Chrome запущен, ожидаем запуска локального отладчика")
 
-        # Ожидаем готовности локального отладчика на порту 9222
-        for i in range(15):
-            try:
-                # Проверяем доступность DevTools API
-                requests.get("http://127.0.0.1:9222/json/version", timeout=1)
-                info("Локальный отладчик Chrome готов к работе")
-                break
-            except Exception:
-                # Задержка перед повторной попыткой подключения
-                time.sleep(1)
-        # Если не удалось подключиться после 15 попыток — завершаем процесс и выдаём ошибку
-        else:
+        # Ожидаем, пока Chrome откроет отладчик и запишет его порт в профиль
+        self.port = self._wait_for_devtools_port(port_file)
+        # Если порт не появился за отведенное время — завершаем процесс и выдаём ошибку
+        if self.port is None:
             self.stop()
             raise Exception("Не удалось подключиться к локальному отладчику Chrome")
+        info(f"Локальный отладчик Chrome готов к работе на порту {self.port}")
+
+    def is_alive(self):
+        """
+        Проверяет, что процесс Chrome жив и локальный отладчик отвечает.
+        """
+        # Процесс не запускался или уже завершился (упал)
+        if self.process is None or self.process.poll() is not None:
+            return False
+        # Процесс жив, проверяем, что DevTools API отвечает
+        try:
+            requests.get(f"{self.devtools_url}/json/version", timeout=2)
+            return True
+        except Exception:
+            return False
+
+    def recycle_reason(self):
+        """
+        Возвращает описание превышенного порога памяти или размера профиля,
+        или None, если браузер укладывается в пороги.
+        """
+        rss = tree_rss(self.process.pid)
+        metrics.set_gauge("chrome_rss_bytes", rss)
+        if CHROME_MAX_RSS_MB and rss > CHROME_MAX_RSS_MB * 2**20:
+            return f"RSS {rss // 2**20} МБ"
+        profile_size = self.profile.size()
+        if CHROME_MAX_PROFILE_MB and profile_size > CHROME_MAX_PROFILE_MB * 2**20:
+            return f"профиль {profile_size // 2**20} МБ"
+        return None
+
+    def ensure_running(self):
+        """
+        Запускает Chrome, если он еще не запущен, и перезапускает его, если он упал, завис
+        или занял слишком много памяти или места на диске.
+        """
+        if self.is_alive():
+            # Браузер работает, отвечает и укладывается в пороги памяти и размера профиля — переиспользуем его
+            reason = self.recycle_reason()
+            if reason is None:
+                return
+            warning(f"Chrome занимает слишком много места ({reason}), перезапускаем")
+            self.stop()
+        # Браузер был запущен, но упал или перестал отвечать — перезапускаем
+        elif self.process is not None:
+            warning("Chrome не отвечает, перезапускаем")
+            self.stop()
+        self.start()
+
+    def _signal_group(self, sig):
+        """
+        Отправляет сигнал всей группе процессов Chrome. Возвращает False, если группы уже нет.
+        """
+        try:
+            os.killpg(self.process.pid, sig)
+            return True
+        except ProcessLookupError:
+            return False
 
     def stop(self):
         """
-        Останавливает процесс Chrome.
+        Останавливает Chrome вместе со всеми его дочерними процессами.
         """
         # Проверяем, запущен ли процесс Chrome для корректного завершения
         if self.process:
             try:
-                # Отправляем сигнал завершения процессу Chrome
-                self.process.terminate()
-                self.process.wait()
+                # Отправляем сигнал завершения всей группе процессов Chrome
+                self._signal_group(signal.SIGTERM)
+                # Ждём фактического завершения процесса, а не фиксированную паузу
+                try:
+                    self.process.wait(timeout=STOP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    # Процесс не завершился за отведенное время — завершаем группу принудительно
+                    warning("Chrome не завершился за отведенное время, завершаем принудительно")
+                    self._signal_group(signal.SIGKILL)
+                    self.process.wait()
+                # Дочерние процессы могли пережить главный — добиваем оставшихся в группе
+                self._signal_group(signal.SIGKILL)
                 self.process = None
-                time.sleep(3)
-                # Ждём 3 секунды для полного завершения процесса
+                self.port = None
                 # Логируем успешное завершение работы Chrome
                 info("Chrome остановлен")
             except Exception as e:
@@ -0,0 +1,162 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Модуль предохранителя (circuit breaker) для проверок мест.
+Содержит класс CircuitBreaker, который:
+- считает подряд идущие неудачные проверки отдельно по типу ошибки (блокировка, вход, сеть)
+- после порога неудач размыкается и пропускает проверки на время экспоненциальной паузы с потолком
+- по окончании паузы пропускает одну пробную проверку (half-open) и по ее исходу замыкается или снова размыкается
+- сообщает в Telegram о размыкании и восстановлении
+- сохраняет свое состояние в файл рядом с профилем Chrome (city-<CITY_ID>-breaker.json), поэтому пауза
+  действует и между одиночными запусками --once из cron, и после перезапуска скрипта
+
+Так во время блокировки Cloudflare или недоступности сайта скрипт не тратит CPU,
+кредиты сервиса решения капчи и запросы к сайту, которые только продлевают блокировку.
+Отключается настройкой CIRCUIT_BREAKER=off.
+"""
+
+import json
+import os
+import random
+import time
+
+from logger.logger import info, telegram, warning
+
+# Типы неудач
+BLOCK = "block"
+AUTH = "auth"
+NETWORK = "network"
+
+# Политики по типу неудачи: (неудач подряд до размыкания, первая пауза в секундах, максимальная пауза в секундах).
+# Блокировка Cloudflare снимается только временем, поэтому размыкаемся сразу и надолго;
+# сетевые сбои обычно кратковременны — терпим несколько и ждем недолго.
+POLICIES = {
+    BLOCK: (1, 30 * 60, 6 * 3600),
+    AUTH: (2, 15 * 60, 2 * 3600),
+    NETWORK: (3, 2 * 60, 30 * 60),
+}
+# Случайный разброс паузы, чтобы проверки после восстановления не шли строго по одной сетке
+JITTER = 0.1
+
+# Состояния предохранителя
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Предохранитель, который приостанавливает проверки после повторяющихся неудач."""
+
+    def __init__(self, city_name, city_id=None, enabled=True):
+        self.city_name = city_name
+        self.enabled = enabled
+        # Файл состояния лежит рядом с профилем Chrome и файлом сессии (None — состояние не сохраняется)
+        self.path = None
+        if city_id is not None:
+            self.path = os.path.expanduser('~') + f'/almaviva-chrome-profiles/city-{city_id}-breaker.json'
+        self.state = CLOSED
+        # Неудачи подряд по типам; успешная проверка сбрасывает счетчики
+        self.failures = {}
+        # Сколько раз подряд предохранитель размыкался — от этого зависит длина паузы
+        self.trips = 0
+        # Тип последней неудачи, из-за которой предохранитель разомкнут
+        self.reason = None
+        # Момент (по монотонным часам), после которого разрешена пробная проверка
+        self.open_until = 0.0
+        self.load()
+
+    def load(self):
+        """Загружает сохраненное состояние, если оно есть."""
+        if not self.enabled or self.path is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.failures = {k: int(v) for k, v in saved.get("failures", {}).items() if k in POLICIES}
+            self.trips = int(saved.get("trips", 0))
+            self.reason = saved.get("reason")
+            # Пробная проверка, прерванная вместе с процессом, повторяется: разомкнутое состояние восстанавливается
+            if saved.get("state") in (OPEN, HALF_OPEN) and self.reason in POLICIES:
+                self.state = OPEN
+                # Момент окончания паузы хранится в unix-времени и переводится в монотонные часы этого процесса
+                self.open_until = time.monotonic() + max(float(saved.get("open_until", 0)) - time.time(), 0.0)
+        except FileNotFoundError:
+            pass
+        # Поврежденный файл не мешает работе — начинаем с замкнутого предохранителя
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            warning(f"Не удалось прочитать состояние предохранителя - {e}")
+
+    def save(self):
+        """Сохраняет состояние на диск; ошибка записи только пишется в лог."""
+        if not self.enabled or self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Пишем во временный файл и подменяем им основной, чтобы не оставить файл недописанным
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "state": self.state,
+                        "failures": self.failures,
+                        "trips": self.trips,
+                        "reason": self.reason,
+                        "open_until": time.time() + self.remaining(),
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            warning(f"Не удалось сохранить состояние предохранителя - {e}")
+
+    def allow(self):
+        """Возвращает True, если проверку можно запускать сейчас."""
+        if not self.enabled or self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() >= self.open_until:
+            # Пауза прошла — пропускаем одну пробную проверку
+            self.state = HALF_OPEN
+            info("Пауза после ошибок (%s) закончилась, выполняем пробную проверку", self.reason)
+        return self.state == HALF_OPEN
+
+    def remaining(self):
+        """Сколько секунд осталось до пробной проверки."""
+        return max(self.open_until - time.monotonic(), 0.0)
+
+    def record_success(self):
+        """Проверка прошла успешно: замыкаем предохранитель и сбрасываем счетчики."""
+        # Без сохраненных неудач состояние не меняется, и файл не перезаписывается
+        changed = self.state != CLOSED or self.failures or self.trips
+        if self.state != CLOSED:
+            info("Проверка после ошибок (%s) прошла успешно, возобновляем обычный режим", self.reason)
+            telegram(f"Almaviva в г. {self.city_name} - проверки возобновлены")
+        self.state = CLOSED
+        self.failures.clear()
+        self.trips = 0
+        self.reason = None
+        if changed:
+            self.save()
+
+    def record_failure(self, kind):
+        """Проверка завершилась неудачей типа kind (BLOCK, AUTH или NETWORK)."""
+        if not self.enabled:
+            return
+        self.failures[kind] = self.failures.get(kind, 0) + 1
+        threshold, base, cap = POLICIES[kind]
+        # Неудачная пробная проверка сразу размыкает предохранитель с увеличенной паузой
+        if self.state != HALF_OPEN and self.failures[kind] < threshold:
+            self.save()
+            return
+        # Пауза растет, пока повторяется неудача того же типа; новый тип начинает отсчет заново
+        self.trips = self.trips + 1 if kind == self.reason else 1
+        pause = min(base * 2 ** (self.trips - 1), cap) * random.uniform(1 - JITTER, 1 + JITTER)
+        self.state = OPEN
+        self.reason = kind
+        self.open_until = time.monotonic() + pause
+        self.save()
+        warning("Проверки приостановлены на %d мин из-за ошибок (%s)", round(pause / 60), kind)
+        # О первом размыкании по этой причине сообщаем в Telegram, повторные после пробных проверок не дублируем
+        if self.trips == 1:
+            telegram(
+                f"Almaviva в г. {self.city_name} - проверки приостановлены "
+                f"на {round(pause / 60)} мин из-за ошибок ({kind})"
+            )
@@ -0,0 +1,130 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Модуль локального API управления расписанием.
+Содержит функцию start, которая по переменной окружения CONTROL_PORT запускает
+HTTP-сервер на 127.0.0.1 с методами:
+- GET /status: состояние расписания, исход и тайминги последней проверки (без новой проверки)
+- GET /healthz: живость — 200, если проверка не зависла дольше дедлайна, иначе 503
+- GET /readyz: готовность — 200, если цикл расписания работает, иначе 503
+- POST /check: внеочередная проверка (выполняется в цикле расписания после текущей)
+- POST /pause, POST /resume: приостановка и возобновление плановых проверок
+- GET /history: сводка истории проверок за 7 дней и окна наличия мест (logger.history)
+
+Если задан CONTROL_TOKEN, все запросы должны содержать заголовок Authorization: Bearer <токен>.
+Методы POST без CONTROL_TOKEN отключены (403): иначе любая веб-страница, открытая в браузере на этой машине,
+могла бы отправить на 127.0.0.1 простой межсайтовый POST и приостановить проверки или запустить лишние.
+Запросы с заголовком Origin (их отправляет браузер со страницы) отклоняются всегда.
+"""
+
+import hmac
+import json
+import os
+import threading
+import time
+
+from logger import history
+from logger.logger import info
+from managers.schedule_manager import ScheduleManager
+
+
+def _status():
+    return 200, ScheduleManager.status()
+
+
+def _healthz():
+    if ScheduleManager.is_healthy():
+        return 200, {"status": "ok"}
+    return 503, {"status": "stuck"}
+
+
+def _readyz():
+    if ScheduleManager.is_ready():
+        return 200, {"status": "ready"}
+    return 503, {"status": "not ready"}
+
+
+def _check():
+    ScheduleManager.request_check()
+    return 202, {"queued": True}
+
+
+def _pause():
+    ScheduleManager.pause()
+    return 200, {"paused": True}
+
+
+def _resume():
+    ScheduleManager.resume()
+    return 200, {"paused": False}
+
+
+def _history():
+    since = int(time.time() - 7 * 86400)
+    return 200, {"summary": history.summary(since), "windows": history.windows(since=since)}
+
+
+# Метод и путь -> обработчик, который возвращает (HTTP-статус, тело ответа)
+ROUTES = {
+    ("GET", "/status"): _status,
+    ("GET", "/healthz"): _healthz,
+    ("GET", "/readyz"): _readyz,
+    ("POST", "/check"): _check,
+    ("POST", "/pause"): _pause,
+    ("POST", "/resume"): _resume,
+    ("GET", "/history"): _history,
+}
+
+
+def start():
+    """Запускает API управления, если задан CONTROL_PORT."""
+    port = os.getenv("CONTROL_PORT")
+    if not port:
+        return None
+    token = os.getenv("CONTROL_TOKEN")
+    # HTTP-сервер загружается только если API включен
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _ControlHandler(BaseHTTPRequestHandler):
+        """Обработчик HTTP-запросов к API управления."""
+
+        def _handle(self, method):
+            # API предназначен для curl и мониторинга, а не для веб-страниц
+            if self.headers.get("Origin") is not None:
+                self._reply(403, {"error": "cross-origin requests are not allowed"})
+                return
+            if token and not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+                self._reply(401, {"error": "unauthorized"})
+                return
+            # Управляющие методы без токена не принимаем
+            if method == "POST" and not token:
+                self._reply(403, {"error": "CONTROL_TOKEN is required for POST requests"})
+                return
+            handler = ROUTES.get((method, self.path.split("?")[0]))
+            if handler is None:
+                self._reply(404, {"error": "not found"})
+                return
+            self._reply(*handler())
+
+        def _reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def log_message(self, format, *args):
+            # Не пишем каждый запрос к API в лог
+            pass
+
+    # API слушает только локальный интерфейс
+    server = ThreadingHTTPServer(("127.0.0.1", int(port)), _ControlHandler)
+    threading.Thread(target=server.serve_forever, name="control-http", daemon=True).start()
+    info("API управления доступно по адресу http://127.0.0.1:%s", port)
+    return server
@@ -3,13 +3,17 @@
 """
 Модуль управления значениями переменных окружения.
 Содержит класс EnvironmentManager с методами:
-- fill_default_values: интерактивно заполняет флаги окружения по умолчанию;
+- fill_default_values: интерактивно запрашивает и сохраняет значения, возвращает измененные пользователем.
+
+Сами настройки собираются и проверяются в managers.settings.
 """
 
 import os
 import json
+import sys
 
 from logger.logger import info, warning
+from managers.settings import CITIES, CONFIG_PATH, SECRET_KEYS
 
 
 class EnvironmentManager:
@@ -44,27 +48,13 @@ class EnvironmentManager:
         """
         Предлагает пользователю выбрать город из списка и возвращает (id, name).
         """
-        cities = {
-            7: "Екатеринбург",
-            8: "Нижний Новгород",
-            9: "Ростов-на-Дону",
-            10: "Новосибирск",
-            11: "Казань",
-            12: "Самара",
-            14: "Москва",
-            16: "Краснодар"
-        }
         while True:
             print("Доступные города для проверки:")
-            for city_id, description in cities.items():
+            for city_id, description in CITIES.items():
                 print(f"  {city_id}: {description}")
             val = input("Введите идентификатор города (число): ").strip()
-            try:
-                num = int(val)
-                if num in cities:
-                    return str(num), cities[num]
-            except ValueError:
-                pass
+            if val in CITIES:
+                return val, CITIES[val]
             warning("Неверный идентификатор. Пожалуйста, введите число из списка.")
 
     @staticmethod
@@ -118,9 +108,17 @@ class EnvironmentManager:
         """
         return EnvironmentManager.prompt_nonempty("Введите идентификатор чата в Telegram: ")
 
-    # Интерактивная установка значений переменных окружения по умолчанию
+    # Интерактивная установка значений по умолчанию
     @staticmethod
-    def fill_default_values():
+    def fill_default_values(config_path=CONFIG_PATH):
+        """
+        Запрашивает значения у пользователя и сохраняет их в env_config.json.
+        Возвращает значения, введенные или измененные пользователем: они перекрывают переменные окружения.
+        Если сохраненные значения есть, а ввод не с терминала (systemd, Docker), ничего не спрашивает.
+        """
+        if os.path.exists(config_path) and not sys.stdin.isatty():
+            info("Ввод не с терминала, используются сохраненные значения")
+            return {}
         print(
             """
             Скрипт умеет проверять наличие мест в Almaviva Россия, и отправлять информацию о наличии мест в Telegram.
@@ -128,14 +126,15 @@ class EnvironmentManager:
             """
         )
 
-        config_path = os.path.join(os.path.dirname(__file__), "env_config.json")
         if os.path.exists(config_path):
             with open(config_path, "r", encoding="utf-8") as f:
                 saved = json.load(f)
             info("Найдены сохранённые значения:")
             for k, v in saved.items():
-                info(f"  {k} = {v}")
+                info("  %s = %s", k, "***" if k in SECRET_KEYS else v)
 
+            # Значения, измененные пользователем в меню
+            edited = {}
             # Меню для работы с сохранёнными значениями
             while True:
                 print("\nВыберите действие:")
@@ -143,10 +142,8 @@ class EnvironmentManager:
                 print("  2: Использовать сохранённые и начать работу")
                 choice = input("Ваш выбор (1/2): ").strip()
                 if choice == "2":
-                    for k, v in saved.items():
-                        os.environ.setdefault(k, v)
                     print("Используются предыдущие значения. Скрипт готов к запуску.")
-                    return
+                    return edited
                 elif choice == "1":
                     # Меню для изменения отдельных переменных
                     while True:
@@ -161,29 +158,28 @@ class EnvironmentManager:
                         print("  8: Продолжить")
                         field_choice = input("Ваш выбор (1-8): ").strip()
                         if field_choice == "1":
-                            saved["CHECK_INTERVAL"] = EnvironmentManager.get_check_interval_value()
+                            edited["CHECK_INTERVAL"] = EnvironmentManager.get_check_interval_value()
                         elif field_choice == "2":
-                            saved["EMAIL"] = EnvironmentManager.get_email_value()
+                            edited["EMAIL"] = EnvironmentManager.get_email_value()
                         elif field_choice == "3":
-                            saved["PASSWORD"] = EnvironmentManager.get_password_value()
+                            edited["PASSWORD"] = EnvironmentManager.get_password_value()
                         elif field_choice == "4":
                             new_id, new_name = EnvironmentManager.get_city_value()
-                            saved["CITY_ID"] = new_id
-                            saved["CITY_NAME"] = new_name
+                            edited["CITY_ID"] = new_id
+                            edited["CITY_NAME"] = new_name
                         elif field_choice == "5":
-                            saved["CAPTCHA_API_KEY"] = EnvironmentManager.get_captcha_key_value()
+                            edited["CAPTCHA_API_KEY"] = EnvironmentManager.get_captcha_key_value()
                         elif field_choice == "6":
-                            saved["TELEGRAM_BOT_TOKEN"] = EnvironmentManager.get_telegram_token_value()
+                            edited["TELEGRAM_BOT_TOKEN"] = EnvironmentManager.get_telegram_token_value()
                         elif field_choice == "7":
-                            saved["TELEGRAM_CHAT_ID"] = EnvironmentManager.get_telegram_chat_id_value()
+                            edited["TELEGRAM_CHAT_ID"] = EnvironmentManager.get_telegram_chat_id_value()
                         elif field_choice == "8":
-                            # Сохраняем обновлённые значения и выставляем в окружение
+                            # Сохраняем обновлённые значения; измененные значения важнее переменных окружения
+                            saved.update(edited)
                             with open(config_path, "w", encoding="utf-8") as f:
                                 json.dump(saved, f, ensure_ascii=False, indent=4)
-                            for k, v in saved.items():
-                                os.environ.setdefault(k, v)
                             info("Значения сохранены.")
-                            return
+                            return edited
                         else:
                             warning("Неверный выбор. Введите цифру от 1 до 8.")
 
@@ -199,9 +195,8 @@ class EnvironmentManager:
         new_values["CAPTCHA_API_KEY"] = EnvironmentManager.get_captcha_key_value()
         new_values["TELEGRAM_BOT_TOKEN"] = EnvironmentManager.get_telegram_token_value()
         new_values["TELEGRAM_CHAT_ID"] = EnvironmentManager.get_telegram_chat_id_value()
-        # Сохраняем все значения в окружение и в файл
-        for k, v in new_values.items():
-            os.environ.setdefault(k, v)
+        # Сохраняем все значения в файл; введенные значения важнее переменных окружения
         with open(config_path, "w", encoding="utf-8") as f:
             json.dump(new_values, f, ensure_ascii=False, indent=4)
         info("Значения сохранены")
+        return new_values
@@ -4,12 +4,9 @@
 Модуль для управления процессами, необходимыми для работы скрипта.
 Содержит класс ProcessManager, который:
 - подключает и завершает сессию Chrome через CDP;
-- задаёт необходимые паузы между этапами.
+- поддерживает резидентный браузер между запусками проверок.
 """
 
-import os
-import time
-
 from logger.logger import info
 from managers.chrome_manager import ChromeManager
 
@@ -21,9 +18,9 @@ class ProcessManager:
     """
 
     # Инициализация: создаём экземпляры менеджеров Squid и Chrome
-    def __init__(self):
+    def __init__(self, settings):
         # Initialize individual managers
-        self.chrome = ChromeManager()
+        self.chrome = ChromeManager(settings.city_id)
 
     def start(self):
         """
@@ -32,9 +29,19 @@ class ProcessManager:
         try:
             # Стартуем браузер Chrome через CDP
             self.chrome.start()
-            time.sleep(2)
             # Логируем успешный запуск всех процессов
-            info("Все процессы запущены, 2 секунды таймаута для открытия всех окон")
+            info("Все процессы запущены")
+        # Обрабатываем ошибки при запуске процессов
+        except Exception as e:
+            raise Exception(f"Ошибка при попытке запустить процессы - {e}")
+
+    def ensure_started(self):
+        """
+        Проверяет, что процессы запущены и отвечают, и при необходимости (пере)запускает их.
+        """
+        try:
+            # Запускаем браузер, если он не запущен или упал; живой браузер переиспользуется
+            self.chrome.ensure_running()
         # Обрабатываем ошибки при запуске процессов
         except Exception as e:
             raise Exception(f"Ошибка при попытке запустить процессы - {e}")
@@ -0,0 +1,54 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Модуль для чтения статистики дерева процессов из /proc (Linux).
+Содержит функции:
+- read_stat: родитель, процессорное время и RSS одного процесса
+- process_tree: процессорное время и RSS процесса и всех его потомков
+- tree_rss: суммарный RSS дерева процессов
+
+На системах без /proc (macOS) функции возвращают пустой результат.
+"""
+
+import os
+
+# Размер страницы и частота тиков для разбора /proc
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def read_stat(pid):
+    """Возвращает (ppid, utime+stime в секундах, rss в байтах) процесса или None."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # Имя процесса в скобках может содержать пробелы, поэтому разбираем поля после него
+    fields = data[data.rindex(")") + 2:].split()
+    return int(fields[1]), (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE
+
+
+def process_tree(root_pid):
+    """Возвращает {pid: (cpu, rss)} для процесса root_pid и всех его потомков."""
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return {}
+    stats = {}
+    for entry in entries:
+        if entry.isdigit():
+            stat = read_stat(int(entry))
+            if stat is not None:
+                stats[int(entry)] = stat
+    tree, queue = {}, [root_pid]
+    while queue:
+        pid = queue.pop()
+        if pid in stats and pid not in tree:
+            tree[pid] = stats[pid][1:]
+            queue.extend(child for child, stat in stats.items() if stat[0] == pid)
+    return tree
+
+
+def tree_rss(root_pid):
+    """Возвращает суммарный RSS процесса root_pid и его потомков в байтах."""
+    return sum(rss for _, rss in process_tree(root_pid).values())
@@ -0,0 +1,113 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Модуль обслуживания профиля Chrome.
+Содержит класс ProfileManager, который:
+- считает размер профиля и отдает его в лог и метрики
+- перед запуском браузера удаляет из профиля то, что не ускоряет следующую проверку:
+  дампы падений, кэши GPU и шейдеров, Service Worker, историю и сессии вкладок
+- ограничивает размер HTTP-кэша и кэша скомпилированного JS (Code Cache): они ускоряют
+  загрузку страницы, но при превышении лимита удаляются целиком и собираются заново
+- сохраняет куки (в том числе допуск Cloudflare и токен авторизации), Local Storage и настройки
+
+Профиль можно обслуживать только пока Chrome не запущен.
+"""
+
+import os
+import shutil
+
+from logger import metrics
+from logger.logger import info, warning
+
+# Максимальный размер каждого из кэшей профиля в мегабайтах (CHROME_PROFILE_CACHE_MB)
+CHROME_PROFILE_CACHE_MB = int(os.getenv("CHROME_PROFILE_CACHE_MB", "128"))
+# Пути внутри профиля, которые не нужны для следующей проверки и удаляются перед запуском
+PRUNE_PATHS = [
+    "Crashpad",
+    "BrowserMetrics",
+    "GrShaderCache",
+    "ShaderCache",
+    "GraphiteDawnCache",
+    "component_crx_cache",
+    "optimization_guide_model_store",
+    "Default/GPUCache",
+    "Default/DawnGraphiteCache",
+    "Default/DawnWebGPUCache",
+    "Default/Service Worker",
+    "Default/blob_storage",
+    "Default/Sessions",
+    "Default/History",
+    "Default/History-journal",
+    "Default/Visited Links",
+    "Default/Top Sites",
+    "Default/Top Sites-journal",
+    "Default/Favicons",
+    "Default/Favicons-journal",
+]
+# Кэши, которые ускоряют загрузку страницы и поэтому только ограничиваются по размеру
+CAPPED_PATHS = ["Default/Cache", "Default/Code Cache"]
+
+
+class ProfileManager:
+    """Обслуживание профиля Chrome одного города."""
+
+    def __init__(self, profile_dir):
+        self.profile_dir = profile_dir
+
+    @staticmethod
+    def _size(path):
+        """Размер файла или папки в байтах (недоступные файлы пропускаются)."""
+        if os.path.isfile(path) or os.path.islink(path):
+            try:
+                return os.lstat(path).st_size
+            except OSError:
+                return 0
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    @staticmethod
+    def _remove(path):
+        """Удаляет файл или папку; возвращает False, если удалить не удалось."""
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            return True
+        except OSError as e:
+            warning(f"Не удалось удалить {path} из профиля Chrome - {e}")
+            return False
+
+    def size(self):
+        """Возвращает размер профиля в байтах и обновляет метрику."""
+        size = self._size(self.profile_dir)
+        metrics.set_gauge("chrome_profile_bytes", size)
+        return size
+
+    def maintain(self):
+        """
+        Чистит профиль перед запуском браузера и возвращает освобожденный объем в байтах.
+        """
+        if not os.path.isdir(self.profile_dir):
+            return 0
+        freed = 0
+        for relative in PRUNE_PATHS:
+            path = os.path.join(self.profile_dir, relative)
+            if os.path.lexists(path):
+                size = self._size(path)
+                if self._remove(path):
+                    freed += size
+        # Кэш, выросший больше лимита, удаляется целиком: Chrome соберет его заново при следующей загрузке
+        for relative in CAPPED_PATHS:
+            path = os.path.join(self.profile_dir, relative)
+            if os.path.isdir(path):
+                size = self._size(path)
+                if size > CHROME_PROFILE_CACHE_MB * 2**20 and self._remove(path):
+                    freed += size
+        info(f"Профиль Chrome: {self.size() / 2**20:.1f} МБ, освобождено {freed / 2**20:.1f} МБ")
+        return freed
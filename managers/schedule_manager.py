@@ -2,56 +2,328 @@
 """
 Модуль для периодического управления задачей проверки мест.
 Содержит класс ScheduleManager с методом job, который:
-- запускает ProcessManager и AlmavivaManager
-- обрабатывает ошибки CDP и общие исключения
-- останавливает процесс корректно
+- поддерживает один резидентный процесс Chrome между запусками и открывает в нем новую вкладку
+  (и перезапускает его, если он занял слишком много памяти)
+- запускает AlmavivaManager
+- обрабатывает ошибки CDP, прерывание по дедлайну и общие исключения
+- через CircuitBreaker пропускает проверки на время паузы после блокировки или повторяющихся ошибок
+Методом run_forever, который запускает job по дедлайнам без наложения запусков:
+- с фиксированной частотой (SCHEDULE_MODE=fixed) или с паузой после окончания проверки (SCHEDULE_MODE=delay)
+- с корректной остановкой по SIGTERM/SIGINT после завершения текущей проверки
+- с внеочередной проверкой, паузой и возобновлением по запросу (request_check, pause, resume)
+- с применением измененного env_config.json без перезапуска (apply_settings)
+Методами status, is_healthy и is_ready для локального API управления (managers.control_server).
+Каждая проверка (в том числе пропущенная) дописывается в историю (logger.history).
+Методом run_once для запуска одной проверки из cron или таймера systemd: браузер останавливается сразу после нее.
+И методом shutdown, который корректно останавливает Chrome при завершении скрипта.
 """
 
-import os
+import math
+import signal
+import threading
+import time
 from datetime import datetime
 
-from pychrome import CallMethodException
-
-from logger.logger import error, info
-from managers.almaviva_manager import AlmavivaManager
+from logger import history, metrics
+from logger.logger import configure_telegram, error, info
+from managers import circuit_breaker
+from managers.almaviva_manager import AlmavivaManager, JobTimeoutError
+from managers.circuit_breaker import CircuitBreaker
 from managers.environment_manager import EnvironmentManager
 from managers.process_manager import ProcessManager
+from services.almaviva_service import LoginError
+from services.cdp_client import CdpError
+from services.chrome_service import BlockedError
+from services.telegram_service import TelegramService
+
+# Как часто поток слежения проверяет время изменения файла настроек, в секундах
+CONFIG_POLL_INTERVAL = 5
+# Запас сверх JOB_TIMEOUT, после которого зависшая проверка считается признаком неработоспособности
+HEALTH_GRACE = 60
 
 
 # Менеджер расписания задач по проверке доступности мест
 class ScheduleManager:
+    # Проверенные настройки, с которыми запущено расписание
+    settings = None
+    # Менеджер процессов, который живет между запусками задачи (резидентный Chrome)
+    process_manager = None
+    # Предохранитель, который приостанавливает проверки после повторяющихся неудач
+    breaker = None
+    # Событие остановки цикла расписания
+    stop_event = threading.Event()
+    # Событие, которое будит цикл расписания раньше дедлайна (сигнал, запрос проверки, возобновление)
+    wake_event = threading.Event()
+    # Запрошена внеочередная проверка
+    check_requested = threading.Event()
+    # Плановые проверки приостановлены (внеочередные выполняются)
+    paused = False
+    # Цикл расписания работает
+    running = False
+    # Следит за изменением env_config.json (None — перечитывание отключено)
+    watcher = None
+    # Исход, время окончания и тайминги этапов последней проверки
+    last_result = None
+    # Момент начала текущей проверки и момент следующей плановой проверки по монотонным часам
+    busy_since = None
+    next_run_at = None
+
     # Основная задача, выполняемая по расписанию
-    @staticmethod
-    def job():
-        info(f'Проверяем места в Almaviva г. {os.getenv("CITY_NAME")}')
+    @classmethod
+    def job(cls):
+        """Выполняет одну проверку и возвращает ее исход (константа из logger.metrics)."""
+        # Предохранитель создается при первом запуске и живет между проверками
+        if cls.breaker is None:
+            cls.breaker = CircuitBreaker(cls.settings.city_name, cls.settings.city_id, cls.settings.circuit_breaker)
+        # Во время паузы после ошибок не запускаем браузер и не обращаемся к сайту
+        if not cls.breaker.allow():
+            metrics.count(metrics.SKIPPED)
+            # Пропущенная проверка тоже попадает в файл метрик
+            metrics.write_textfile()
+            info(f"Проверка пропущена, до пробной проверки {math.ceil(cls.breaker.remaining() / 60)} мин")
+            cls.last_result = {"outcome": metrics.SKIPPED, "finished_at": time.time(), "cities": {}, "timings": {}}
+            history.record(metrics.SKIPPED, {}, {})
+            return metrics.SKIPPED
+
+        info(f"Проверяем места в Almaviva г. {cls.settings.city_name}")
 
-        pm = None
-        # Подготовка ProcessManager для запуска процессов
+        metrics.begin_check()
+        cls.busy_since = time.monotonic()
+        # Результаты по городам (пусто, если проверка не дошла до запроса мест)
+        cities = {}
         try:
-            # Создаем менеджера процессов
-            pm = ProcessManager()
-            # Запускаем необходимые процессы (браузер, прокси)
-            pm.start()
-            # Создаем менеджера Almaviva для проверки мест
-            almaviva = AlmavivaManager()
-            # Выполняем основной рабочий процесс проверки мест
-            almaviva.run()
-        # Игнорируем специфичные ошибки CDP при выполнении
-        except CallMethodException as e:
-            pass
+            with metrics.span("check"):
+                # Создаем менеджера процессов при первом запуске
+                if cls.process_manager is None:
+                    cls.process_manager = ProcessManager(cls.settings)
+                # Запускаем браузер, если он еще не запущен, упал или перестал отвечать
+                with metrics.span("browser"):
+                    cls.process_manager.ensure_started()
+                # Создаем менеджера Almaviva для проверки мест
+                almaviva = AlmavivaManager(cls.process_manager.chrome.devtools_url, cls.settings)
+                # Выполняем основной рабочий процесс проверки мест в новой вкладке
+                is_available = almaviva.run()
+                cities = almaviva.results
+            outcome = metrics.AVAILABLE if is_available else metrics.UNAVAILABLE
+            cls.breaker.record_success()
+            # Логируем успешное выполнение проверки
+            info("Скрипт выполнен успешно")
+        # Блокировка от Cloudflare
+        except BlockedError as e:
+            outcome = metrics.BLOCKED
+            cls.breaker.record_failure(circuit_breaker.BLOCK)
+            error(f"Выполнение скрипта завершено из-за ошибки: {e}")
+        # Не удалось войти в учетную запись
+        except LoginError as e:
+            outcome = metrics.LOGIN_FAILURE
+            cls.breaker.record_failure(circuit_breaker.AUTH)
+            error(f"Выполнение скрипта завершено из-за ошибки: {e}")
+        # Проверка прервана по дедлайну JOB_TIMEOUT, следующая запустится по расписанию
+        except JobTimeoutError as e:
+            outcome = metrics.TIMEOUT
+            cls.breaker.record_failure(circuit_breaker.NETWORK)
+            error(f"Выполнение скрипта завершено из-за ошибки: {e}")
+        # Ошибки CDP (в том числе таймауты) логируем отдельно
+        except CdpError as e:
+            outcome = metrics.CDP_ERROR
+            cls.breaker.record_failure(circuit_breaker.NETWORK)
+            error(f"Ошибка CDP при выполнении скрипта: {e}")
         # Обрабатываем общие ошибки и логируем их
         except Exception as e:
+            outcome = metrics.ERROR
+            # Прочие ошибки (сайт не ответил, упал браузер) считаем сетевыми сбоями
+            cls.breaker.record_failure(circuit_breaker.NETWORK)
             error(f"Выполнение скрипта завершено из-за ошибки: {e}")
-        # Гарантированное завершение: остановка процесса и логирование
         finally:
-            try:
-                # Останавливаем процессы
-                pm.stop()
-                # Логируем успешное выполнение скрипта
-                info("Скрипт выполнен успешно")
-            # Игнорируем ошибки CDP при остановке
-            except CallMethodException as e:
-                pass
-            # Обрабатываем ошибки при остановке и логируем
-            except Exception as e:
-                error(f"Выполнение скрипта завершено из-за ошибки: {e}")
+            cls.busy_since = None
+        # Исход учитывается до end_check: он перезаписывает файл метрик, и в нем должна быть эта проверка
+        metrics.count(outcome)
+        timings = metrics.end_check()
+        # Словарь заменяется целиком, поэтому API управления читает его из своего потока без блокировок
+        cls.last_result = {
+            "outcome": outcome,
+            "finished_at": time.time(),
+            "cities": cities,
+            "timings": {phase: round(seconds, 4) for phase, seconds in timings.items()},
+        }
+        # В историю результаты пишутся по идентификаторам городов
+        site_results = {city_id: cities[name] for city_id, name in cls.settings.cities if name in cities}
+        history.record(outcome, site_results, timings)
+        return outcome
+
+    # Остановка резидентного браузера при завершении скрипта
+    @classmethod
+    def shutdown(cls):
+        if cls.process_manager is None:
+            return
+        try:
+            # Останавливаем процессы
+            cls.process_manager.stop()
+            cls.process_manager = None
+        # Игнорируем ошибки CDP при остановке
+        except CdpError as e:
+            pass
+        # Обрабатываем ошибки при остановке и логируем
+        except Exception as e:
+            error(f"Выполнение скрипта завершено из-за ошибки: {e}")
+
+    # Одна проверка без резидентного процесса: браузер запускается и останавливается в рамках проверки
+    @classmethod
+    def run_once(cls, settings):
+        """Выполняет одну проверку, останавливает Chrome и возвращает исход проверки."""
+        cls.settings = settings
+        try:
+            return cls.job()
+        finally:
+            cls.shutdown()
+
+    # Обработчик SIGTERM/SIGINT: текущая проверка доводится до конца, новые не запускаются
+    @classmethod
+    def _on_signal(cls, signum, frame):
+        info(f"Получен сигнал {signal.Signals(signum).name}, завершаем работу после текущей проверки")
+        cls.stop_event.set()
+        cls.wake_event.set()
+
+    # Внеочередная проверка: выполняется в цикле расписания, поэтому не накладывается на плановую
+    @classmethod
+    def request_check(cls):
+        info("Запрошена внеочередная проверка")
+        cls.check_requested.set()
+        cls.wake_event.set()
+
+    # Приостановка плановых проверок
+    @classmethod
+    def pause(cls):
+        info("Плановые проверки приостановлены")
+        cls.paused = True
+
+    # Возобновление плановых проверок
+    @classmethod
+    def resume(cls):
+        info("Плановые проверки возобновлены")
+        cls.paused = False
+        cls.wake_event.set()
+
+    # Поток слежения за файлом настроек: будит цикл расписания, когда файл изменился
+    @classmethod
+    def _watch_config(cls):
+        while not cls.stop_event.wait(CONFIG_POLL_INTERVAL):
+            watcher = cls.watcher
+            if watcher is not None and watcher.changed():
+                cls.wake_event.set()
+
+    # Применение новых настроек без перезапуска скрипта
+    @classmethod
+    def apply_settings(cls, settings):
+        old = cls.settings
+        cls.settings = settings
+        configure_telegram(settings.telegram_bot_token, settings.telegram_chat_id)
+        changed = [name for name in settings.__dataclass_fields__ if getattr(old, name) != getattr(settings, name)]
+        info(f"Применены новые настройки: {', '.join(changed)}")
+        # У другого (первого) города свой профиль Chrome и своя сессия
+        if settings.city_id != old.city_id:
+            cls.shutdown()
+        # Для другого набора городов уведомления и предохранитель начинают с чистого листа
+        if settings.cities != old.cities:
+            TelegramService.reset()
+            cls.breaker = None
+        # Включенный или выключенный предохранитель создается заново при следующей проверке
+        elif settings.circuit_breaker != old.circuit_breaker:
+            cls.breaker = None
+
+    # Состояние расписания для API управления
+    @classmethod
+    def status(cls):
+        now = time.monotonic()
+        breaker = cls.breaker
+        process_manager = cls.process_manager
+        return {
+            "running": cls.running,
+            "paused": cls.paused,
+            "checking": cls.busy_since is not None,
+            "next_check_in_s": round(max(cls.next_run_at - now, 0), 1) if cls.next_run_at else None,
+            "settings": {
+                "city_id": cls.settings.city_id,
+                "city_name": cls.settings.city_name,
+                "cities": [city_id for city_id, _ in cls.settings.cities],
+                "check_interval": cls.settings.check_interval,
+                "schedule_mode": cls.settings.schedule_mode,
+            } if cls.settings else None,
+            "breaker": {
+                "state": breaker.state,
+                "reason": breaker.reason,
+                "retry_in_s": round(breaker.remaining(), 1),
+            } if breaker else None,
+            "browser_running": process_manager is not None and process_manager.chrome.process is not None,
+            "last_result": cls.last_result,
+        }
+
+    # Живость: проверка не висит дольше дедлайна (значит, основной поток не заблокирован)
+    @classmethod
+    def is_healthy(cls):
+        busy_since = cls.busy_since
+        return busy_since is None or time.monotonic() - busy_since < cls.settings.job_timeout + HEALTH_GRACE
+
+    # Готовность: цикл расписания запущен и не останавливается
+    @classmethod
+    def is_ready(cls):
+        return cls.running and not cls.stop_event.is_set()
+
+    # Цикл расписания: спит ровно до следующего дедлайна и не допускает наложения запусков
+    @classmethod
+    def run_forever(cls, settings, watcher=None):
+        """
+        Запускает job каждые settings.check_interval минут до получения SIGTERM/SIGINT.
+        settings.schedule_mode: "fixed" — фиксированная частота от момента старта проверок,
+                                "delay" — пауза после окончания каждой проверки.
+        watcher: SettingsWatcher, новые настройки из которого применяются без перезапуска: отдельный поток
+                 раз в CONFIG_POLL_INTERVAL секунд сверяет время изменения файла и будит цикл, только если файл изменился.
+        """
+        cls.settings = settings
+        cls.watcher = watcher
+        interval = settings.check_interval * 60
+        signal.signal(signal.SIGTERM, cls._on_signal)
+        signal.signal(signal.SIGINT, cls._on_signal)
+
+        # Дедлайны считаем по монотонным часам, чтобы перевод системного времени их не сдвигал
+        next_run = time.monotonic() + interval
+        cls.running = True
+        if watcher is not None:
+            threading.Thread(target=cls._watch_config, name="config-watcher", daemon=True).start()
+        try:
+            while not cls.stop_event.is_set():
+                cls.next_run_at = next_run
+                # Спим ровно до дедлайна; сигнал, запрос проверки и возобновление будят цикл сразу
+                cls.wake_event.wait(max(next_run - time.monotonic(), 0))
+                cls.wake_event.clear()
+                if cls.stop_event.is_set():
+                    break
+
+                # Применяем измененный env_config.json; новый интервал сдвигает ближайший дедлайн
+                new_settings = cls.watcher.poll() if cls.watcher is not None else None
+                if new_settings is not None:
+                    cls.apply_settings(new_settings)
+                    new_interval = new_settings.check_interval * 60
+                    next_run += new_interval - interval
+                    interval = new_interval
+
+                now = time.monotonic()
+                manual = cls.check_requested.is_set()
+                if not manual and now < next_run:
+                    continue
+                if not manual and cls.paused:
+                    # На паузе плановые дедлайны пропускаются, сетка сохраняется
+                    next_run += interval * max(math.ceil((now - next_run) / interval), 1)
+                    continue
+                cls.check_requested.clear()
+                cls.job()
+                now = time.monotonic()
+                if cls.settings.schedule_mode == "delay":
+                    next_run = now + interval
+                elif now >= next_run:
+                    # Проверка заняла дольше интервала — пропускаем прошедшие дедлайны, сохраняя сетку
+                    next_run += interval * max(math.ceil((now - next_run) / interval), 1)
+        finally:
+            cls.running = False
+            # Chrome живет между проверками, поэтому останавливаем его при выходе из цикла
+            cls.shutdown()
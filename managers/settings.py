@@ -0,0 +1,259 @@
+#  Copyright Feliks Zubarev (c) 2025.
+"""
+Модуль настроек скрипта.
+Содержит:
+- Класс Settings: неизменяемый набор проверенных настроек (включая таймауты, режим уведомлений и предохранитель),
+  который передается менеджерам и сервисам
+- Класс SettingsError: ошибка конфигурации со списком всех найденных проблем
+- Функцию load: собирает настройки из файла env_config.json, переменных окружения и аргументов командной строки
+  (CITY_ID может содержать несколько городов через запятую — они проверяются в одной сессии)
+- Класс SettingsWatcher: замечает изменение env_config.json и перечитывает настройки без перезапуска скрипта
+
+Приоритет источников (каждый следующий перекрывает предыдущий):
+1. сохраненные значения из env_config.json
+2. переменные окружения — если они расходятся с сохраненными значениями, об этом пишется в лог;
+   исключение — значения, измененные в интерактивном меню (file_keys): для них сохраненное значение важнее
+3. явно заданные значения: аргументы командной строки
+
+Модуль не импортирует ничего тяжелее стандартной библиотеки, чтобы ошибка конфигурации
+обнаруживалась до загрузки сетевых библиотек и запуска браузера.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+
+from logger.logger import info, warning
+
+# Файл с сохраненными значениями
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "env_config.json")
+
+# Города, для которых сайт выдает слоты: идентификатор -> название
+CITIES = {
+    "7": "Екатеринбург",
+    "8": "Нижний Новгород",
+    "9": "Ростов-на-Дону",
+    "10": "Новосибирск",
+    "11": "Казань",
+    "12": "Самара",
+    "14": "Москва",
+    "16": "Краснодар",
+}
+
+# Режимы расписания проверок
+SCHEDULE_MODES = ("fixed", "delay")
+# Режимы уведомлений в Telegram
+NOTIFY_MODES = ("always", "changes")
+
+# Ключи настроек, как они называются в env_config.json и в окружении
+KEYS = (
+    "CHECK_INTERVAL",
+    "EMAIL",
+    "PASSWORD",
+    "CITY_ID",
+    "CITY_NAME",
+    "CAPTCHA_API_KEY",
+    "TELEGRAM_BOT_TOKEN",
+    "TELEGRAM_CHAT_ID",
+    "SCHEDULE_MODE",
+    "JOB_TIMEOUT",
+    "FETCH_TIMEOUT",
+    "CITY_CHECK_DELAY",
+    "CAPTCHA_TIMEOUT",
+    "CAPTCHA_POLL_INTERVAL",
+    "TELEGRAM_NOTIFY_MODE",
+    "TELEGRAM_HEARTBEAT_HOURS",
+    "CIRCUIT_BREAKER",
+)
+# Числовые настройки в секундах (часах): ключ -> (значение по умолчанию, может ли быть нулем)
+NUMBER_KEYS = {
+    "JOB_TIMEOUT": (300.0, False),
+    "FETCH_TIMEOUT": (20.0, False),
+    "CITY_CHECK_DELAY": (15.0, True),
+    "CAPTCHA_TIMEOUT": (200.0, False),
+    "CAPTCHA_POLL_INTERVAL": (5.0, True),
+    "TELEGRAM_HEARTBEAT_HOURS": (0.0, True),
+}
+# Необязательные ключи: у остальных нет значения по умолчанию
+OPTIONAL_KEYS = {"CHECK_INTERVAL", "SCHEDULE_MODE", "TELEGRAM_NOTIFY_MODE", "CIRCUIT_BREAKER", *NUMBER_KEYS}
+# Значения, которые не выводим в лог целиком
+SECRET_KEYS = {"PASSWORD", "CAPTCHA_API_KEY", "TELEGRAM_BOT_TOKEN"}
+
+
+class SettingsError(Exception):
+    """Настройки не заданы или заданы неверно."""
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Проверенные настройки скрипта. Секреты не попадают в repr и, значит, в логи."""
+
+    email: str
+    password: str = field(repr=False)
+    city_id: str
+    city_name: str
+    captcha_api_key: str = field(repr=False)
+    telegram_bot_token: str = field(repr=False)
+    telegram_chat_id: str
+    # Интервал проверки в минутах (не нужен для одиночного запуска --once)
+    check_interval: int | None = None
+    schedule_mode: str = "fixed"
+    # Города проверки: кортеж пар (идентификатор, название); city_id — первый из них,
+    # по нему называются профиль Chrome и файл сессии, city_name — названия через запятую
+    cities: tuple = ()
+    # Таймауты и паузы в секундах
+    job_timeout: float = NUMBER_KEYS["JOB_TIMEOUT"][0]
+    fetch_timeout: float = NUMBER_KEYS["FETCH_TIMEOUT"][0]
+    city_check_delay: float = NUMBER_KEYS["CITY_CHECK_DELAY"][0]
+    captcha_timeout: float = NUMBER_KEYS["CAPTCHA_TIMEOUT"][0]
+    captcha_poll_interval: float = NUMBER_KEYS["CAPTCHA_POLL_INTERVAL"][0]
+    # Режим уведомлений и период сводки без изменений в часах (0 — без сводки)
+    telegram_notify_mode: str = "always"
+    telegram_heartbeat_hours: float = NUMBER_KEYS["TELEGRAM_HEARTBEAT_HOURS"][0]
+    # Включен ли предохранитель
+    circuit_breaker: bool = True
+
+
+def _read_file(config_path):
+    """Читает сохраненные значения; отсутствующий файл — пустой набор."""
+    if not config_path or not os.path.exists(config_path):
+        return {}
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SettingsError(f"Не удалось прочитать {config_path} - {e}")
+    if not isinstance(saved, dict):
+        raise SettingsError(f"В {config_path} ожидается JSON-объект")
+    return {k: str(v) for k, v in saved.items() if k in KEYS and v is not None}
+
+
+def load(overrides=None, config_path=CONFIG_PATH, require_interval=True, file_keys=()):
+    """
+    Собирает настройки из файла, окружения и явно заданных значений overrides ({"CITY_ID": "14", ...})
+    и проверяет их. Для ключей file_keys (измененных в меню) значение из файла важнее окружения,
+    поэтому их дальнейшие правки в файле тоже применяются. Выбрасывает SettingsError со списком всех проблем.
+    """
+    values = _read_file(config_path)
+    for key in KEYS:
+        env_value = os.getenv(key)
+        if env_value is None or env_value == "":
+            continue
+        if key in file_keys and key in values:
+            continue
+        # Окружение перекрывает сохраненное значение — сообщаем об этом, а не молча
+        if key in values and values[key] != env_value:
+            info("%s берется из переменной окружения, а не из сохраненных значений", key)
+        values[key] = env_value
+    for key, value in (overrides or {}).items():
+        if value is not None and value != "":
+            values[key] = str(value)
+    values = {k: v.strip() for k, v in values.items()}
+
+    problems = []
+    # CITY_ID может содержать несколько городов через запятую, CITY_NAME — их названия в том же порядке
+    city_ids = [i.strip() for i in values.get("CITY_ID", "").split(",") if i.strip()]
+    # Названия можно не задавать, если все города есть в списке
+    if city_ids and not values.get("CITY_NAME") and all(i in CITIES for i in city_ids):
+        values["CITY_NAME"] = ", ".join(CITIES[i] for i in city_ids)
+    city_names = [n.strip() for n in values.get("CITY_NAME", "").split(",") if n.strip()]
+    required = [k for k in KEYS if k not in OPTIONAL_KEYS]
+    if require_interval:
+        required.append("CHECK_INTERVAL")
+    missing = [k for k in required if not values.get(k)]
+    if missing:
+        problems.append(f"не заданы {', '.join(missing)}")
+
+    check_interval = None
+    if values.get("CHECK_INTERVAL"):
+        try:
+            check_interval = int(values["CHECK_INTERVAL"])
+        except ValueError:
+            check_interval = 0
+        if not 1 <= check_interval <= 1440:
+            problems.append("CHECK_INTERVAL должен быть целым числом от 1 до 1440")
+    if values.get("CITY_ID") and not (city_ids and all(i.isdigit() for i in city_ids)):
+        problems.append("CITY_ID должен быть числом или списком чисел через запятую")
+    elif len(set(city_ids)) != len(city_ids):
+        problems.append("CITY_ID содержит повторяющиеся города")
+    if city_ids and city_names and len(city_names) != len(city_ids):
+        problems.append("CITY_NAME должен содержать по одному названию на каждый город из CITY_ID")
+    schedule_mode = values.get("SCHEDULE_MODE", "fixed").lower()
+    if schedule_mode not in SCHEDULE_MODES:
+        problems.append(f"SCHEDULE_MODE должен быть одним из: {', '.join(SCHEDULE_MODES)}")
+    numbers = {}
+    for key, (default, zero_allowed) in NUMBER_KEYS.items():
+        try:
+            numbers[key] = float(values.get(key, default))
+        except ValueError:
+            numbers[key] = -1.0
+        if not (numbers[key] >= 0 if zero_allowed else numbers[key] > 0) or numbers[key] == float("inf"):
+            problems.append(f"{key} должен быть {'неотрицательным' if zero_allowed else 'положительным'} числом")
+    notify_mode = values.get("TELEGRAM_NOTIFY_MODE", "always").lower()
+    if notify_mode not in NOTIFY_MODES:
+        problems.append(f"TELEGRAM_NOTIFY_MODE должен быть одним из: {', '.join(NOTIFY_MODES)}")
+    circuit_breaker = values.get("CIRCUIT_BREAKER", "on").lower()
+    if circuit_breaker not in ("on", "off"):
+        problems.append("CIRCUIT_BREAKER должен быть on или off")
+    if problems:
+        raise SettingsError("; ".join(problems))
+
+    return Settings(
+        email=values["EMAIL"],
+        password=values["PASSWORD"],
+        city_id=city_ids[0],
+        city_name=", ".join(city_names),
+        captcha_api_key=values["CAPTCHA_API_KEY"],
+        telegram_bot_token=values["TELEGRAM_BOT_TOKEN"],
+        telegram_chat_id=values["TELEGRAM_CHAT_ID"],
+        check_interval=check_interval,
+        schedule_mode=schedule_mode,
+        cities=tuple(zip(city_ids, city_names)),
+        job_timeout=numbers["JOB_TIMEOUT"],
+        fetch_timeout=numbers["FETCH_TIMEOUT"],
+        city_check_delay=numbers["CITY_CHECK_DELAY"],
+        captcha_timeout=numbers["CAPTCHA_TIMEOUT"],
+        captcha_poll_interval=numbers["CAPTCHA_POLL_INTERVAL"],
+        telegram_notify_mode=notify_mode,
+        telegram_heartbeat_hours=numbers["TELEGRAM_HEARTBEAT_HOURS"],
+        circuit_breaker=circuit_breaker == "on",
+    )
+
+
+class SettingsWatcher:
+    """Следит за временем изменения файла настроек и перечитывает их при изменении."""
+
+    def __init__(self, current, overrides=None, config_path=CONFIG_PATH, require_interval=True, file_keys=()):
+        self.current = current
+        self.overrides = overrides
+        self.file_keys = file_keys
+        self.config_path = config_path
+        self.require_interval = require_interval
+        self._mtime = self._stat()
+
+    def _stat(self):
+        try:
+            return os.stat(self.config_path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def changed(self):
+        """Возвращает True, если файл изменился с последнего poll (только проверка времени изменения)."""
+        return self._stat() != self._mtime
+
+    def poll(self):
+        """Возвращает новые настройки, если файл изменился и настройки в нем верные, иначе None."""
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            settings = load(self.overrides, self.config_path, self.require_interval, self.file_keys)
+        # С неверным файлом продолжаем работать на прежних настройках
+        except SettingsError as e:
+            warning(f"Измененные настройки не применены: {e}")
+            return None
+        if settings == self.current:
+            return None
+        self.current = settings
+        return settings
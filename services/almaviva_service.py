@@ -3,115 +3,173 @@
 """
 almaviva_service.py — модуль для работы с API визового сервиса Almaviva.
 Содержит класс AlmavivaService, который:
-- перехватывает и обновляет заголовки запросов
-- строит JS-выражения для fetch-запросов через DevTools Protocol
+- один раз перехватывает заголовки запроса страницы визового сервиса
+- устанавливает на страницу JS-хелпер для fetch-запросов и вызывает его через DevTools Protocol
 - выполняет вход в учетную запись
-- проверяет доступность слотов на сайте.
+- проверяет доступность слотов на сайте для одного или нескольких городов в одной сессии
+  (между запросами по разным городам выдерживается пауза CITY_CHECK_DELAY).
 """
 
 import json
 import os
+import threading
 
-from logger.logger import info
+from logger.logger import debug, info
 
-# API endpoints
-BASE_URL = "https://ru.almaviva-visa.services"
+# API endpoints (ALMAVIVA_BASE_URL позволяет подменить сайт локальной заглушкой для бенчмарков)
+BASE_URL = os.getenv("ALMAVIVA_BASE_URL", "https://ru.almaviva-visa.services")
 LOGIN_URL = f"{BASE_URL}/api/login"
 AVAILABILITY_URL = f"{BASE_URL}/api/getDisponibilityi?siteId="
 
+# Запас времени на ответ CDP сверх таймаута самого запроса
+FETCH_CDP_MARGIN = 5
+
+# Типы запросов, из которых берутся заголовки для вызовов API
+HEADER_SOURCE_TYPES = ("Document", "XHR", "Fetch")
+
+# JS-хелпер для fetch-запросов, устанавливается один раз на каждый документ
+FETCH_HELPER = r"""
+window.__almavivaFetch = async (url, method, headers, token, body, returnType, timeoutMs) => {
+  const h = Object.assign({}, headers);
+  if (token) h["Authorization"] = "Bearer " + token;
+  if (body !== null) h["Content-Type"] = "application/json";
+  // Запрос и чтение тела прерываются по таймауту, чтобы зависший сервер не держал проверку
+  const controller = new AbortController();
+  const timer = setTimeout(() => controller.abort(), timeoutMs);
+  try {
+    const r = await fetch(url, {
+      method: method,
+      headers: h,
+      credentials: "include",
+      body: body !== null ? JSON.stringify(body) : undefined,
+      signal: controller.signal
+    });
+    if (returnType === "status") return r.status;
+    if (returnType === "json") return r.status === 200 ? await r.json() : {"error": "json parse failed"};
+    return r.status === 200 ? await r.text() : "false";
+  } catch (e) {
+    if (e.name === "AbortError") throw new Error("timeout " + timeoutMs + " ms");
+    throw e;
+  } finally {
+    clearTimeout(timer);
+  }
+};
+"""
+# Вызов установленного хелпера через Runtime.callFunctionOn
+FETCH_CALL = "function() { return window.__almavivaFetch.apply(null, arguments); }"
+
+
+class LoginError(Exception):
+    """Не удалось войти в учетную запись Almaviva."""
+
+
+class CheckCancelled(Exception):
+    """Проверка городов прервана (например, по дедлайну проверки)."""
+
 
 class AlmavivaService:
     """Сервис для вызовов API Almaviva."""
 
     def _on_request(self, **kwargs):
-        """Сохраняем заголовки первого запроса к визовому сервису."""
+        """Сохраняем заголовки первого запроса страницы (или XHR) к визовому сервису и отписываемся."""
+        if kwargs.get("type") not in HEADER_SOURCE_TYPES:
+            return
         req = kwargs.get("request", {})
         url = req.get("url", "")
         if url.startswith(BASE_URL):
-            self.headers = req.get("headers", {})
-            info("Обновлены хэдеры для запроса")
-
-    def _build_fetch_expression(self, url, method="GET", return_type="text", body=None):
+            # Обработчик вызывается в потоке чтения CDP, поэтому меняем заголовки под блокировкой
+            with self.headers_lock:
+                self.headers = dict(req.get("headers", {}))
+            debug("Получены хэдеры из запроса %s", url)
+            # Заголовки нужны один раз — остальные запросы страницы больше не разбираем
+            self.headers_tab.Network.requestWillBeSent = None
+
+    def _on_execution_context_created(self, **kwargs):
+        """Запоминаем основной JS-контекст страницы визового сервиса."""
+        context = kwargs.get("context", {})
+        if context.get("origin") == BASE_URL and context.get("auxData", {}).get("isDefault"):
+            self.context_id = context.get("id")
+
+    def _on_execution_context_destroyed(self, **kwargs):
+        """Сбрасываем контекст, если он уничтожен."""
+        if kwargs.get("executionContextId") == self.context_id:
+            self.context_id = None
+
+    def _on_execution_contexts_cleared(self, **kwargs):
+        """Сбрасываем контекст при переходе на другую страницу."""
+        self.context_id = None
+
+    def _fetch(self, tab, url, method="GET", return_type="text", body=None):
         """
-        Строит JS-выражение для fetch-запроса через CDP.
+        Выполняет fetch-запрос через установленный на странице JS-хелпер.
         method: "GET" или "POST"
-        return_type: "text" или "json"
+        return_type: "status", "text" или "json"
         """
-        headers_json = json.dumps(self.headers)
-        # Добавляем Content-Type при наличии тела запроса
-        content_line = (
-            'h["Content-Type"] = "application/json";' if body is not None else ""
-        )
-        # Добавляем Authorization только если передан token
-        auth_line = f'h["Authorization"] = "Bearer {self.token}";' if self.token else ""
-        body_str = (
-            f", body: JSON.stringify({json.dumps(body)})" if body is not None else ""
+        if self.context_id is None:
+            raise Exception("Страница визового сервиса не загружена")
+        # Аргументы передаются структурно, без подстановки в исходный код JS
+        with self.headers_lock:
+            headers = dict(self.headers)
+        args = [url, method, headers, self.token, body, return_type, int(self.fetch_timeout * 1000)]
+        # Ответ CDP ждем чуть дольше, чем сам запрос: сначала срабатывает таймаут fetch на странице
+        resp = tab.Runtime.callFunctionOn(
+            functionDeclaration=FETCH_CALL,
+            executionContextId=self.context_id,
+            arguments=[{"value": arg} for arg in args],
+            awaitPromise=True,
+            returnByValue=True,
+            _timeout=self.fetch_timeout + FETCH_CDP_MARGIN,
         )
-        if return_type == "status":
-            return f"""
-                (async () => {{
-                    const h = {headers_json};
-                    {auth_line}
-                    {content_line}
-                    const r = await fetch("{url}", {{
-                        method: "{method}",
-                        headers: h,
-                        credentials: "include"{body_str}
-                    }});
-                    return r.status;
-                }})()
-            """
-        elif return_type == "json":
-            return f"""
-                (async () => {{
-                    const h = {headers_json};
-                    {auth_line}
-                    {content_line}
-                    const r = await fetch("{url}", {{
-                        method: "{method}",
-                        headers: h,
-                        credentials: "include"{body_str}
-                    }});
-                    return r.status === 200 ? JSON.stringify(await r.json()) : {{"error": "json stringify failed"}};
-                }})()
-            """
-        else:
-            # return_type == "text"
-            return f"""
-                (async () => {{
-                    const h = {headers_json};
-                    {auth_line}
-                    {content_line}
-                    const r = await fetch("{url}", {{
-                        method: "{method}",
-                        headers: h,
-                        credentials: "include"{body_str}
-                    }});
-                    return r.status === 200 ? await r.text() : "false";
-                }})()
-            """
+        # Исключение на странице (в том числе таймаут запроса) возвращается в exceptionDetails
+        if "exceptionDetails" in resp:
+            details = resp["exceptionDetails"]
+            reason = details.get("exception", {}).get("description") or details.get("text")
+            raise Exception(f"Запрос {url.split('?')[0]} не выполнен - {reason}")
+        return resp
 
     # Инициализация сервиса: HTTP-заголовки и токен еще не заданы
-    def __init__(self):
+    def __init__(self, settings):
         self.headers = {}
+        self.headers_lock = threading.Lock()
+        # Вкладка, на которой ожидаются заголовки
+        self.headers_tab = None
         self.token = None
-
-        # Загружаем учетные данные для входа из переменных окружения
-        self.mail = os.getenv("EMAIL")
-        self.password = os.getenv("PASSWORD")
-        self.city_id = os.getenv("CITY_ID")
-        self.city_name = os.getenv("CITY_NAME")
+        # JS-контекст страницы, в котором установлен fetch-хелпер
+        self.context_id = None
+
+        # Учетные данные для входа и города проверки
+        self.mail = settings.email
+        self.password = settings.password
+        self.cities = settings.cities or ((settings.city_id, settings.city_name),)
+        # Максимальное время одного запроса к API в секундах (FETCH_TIMEOUT)
+        self.fetch_timeout = settings.fetch_timeout
+        # Пауза между запросами слотов по разным городам в секундах (CITY_CHECK_DELAY):
+        # сайт блокирует за частые запросы примерно с пятого города подряд
+        self.city_check_delay = settings.city_check_delay
+        # Событие выставляется, когда проверку нужно прервать
+        self.cancelled = threading.Event()
 
     # Добавляем слушатель на события сети для обновления заголовков
     def add_headers_listener(self, tab):
+        self.headers_tab = tab
         tab.Network.requestWillBeSent = self._on_request
 
+    # Устанавливаем fetch-хелпер на каждый новый документ и отслеживаем JS-контекст страницы
+    def install_fetch_helper(self, tab):
+        tab.Runtime.executionContextCreated = self._on_execution_context_created
+        tab.Runtime.executionContextDestroyed = self._on_execution_context_destroyed
+        tab.Runtime.executionContextsCleared = self._on_execution_contexts_cleared
+        tab.Page.addScriptToEvaluateOnNewDocument(source=FETCH_HELPER)
+
     def login(self, tab):
         # Устанавливаем базовые заголовки для запроса входа
-        self.headers["Referer"] = f"{BASE_URL}/signin"
-        self.headers["Origin"] = BASE_URL
-        # Строим JavaScript-выражение для выполнения POST-запроса авторизации
-        expr = self._build_fetch_expression(
+        with self.headers_lock:
+            self.headers["Referer"] = f"{BASE_URL}/signin"
+            self.headers["Origin"] = BASE_URL
+        info("Входим в учетную запись")
+        # Выполняем POST-запрос авторизации через fetch-хелпер страницы
+        resp = self._fetch(
+            tab,
             LOGIN_URL,
             method="POST",
             return_type="json",
@@ -121,22 +179,20 @@ class AlmavivaService:
                 "lang": "en",
             },
         )
-        info("Входим в учетную запись")
-        resp = tab.Runtime.evaluate(expression=expr, awaitPromise=True)
 
         result_value = resp.get("result", {}).get("value")
         if result_value is None:
-            raise Exception("Не удалось получить ответ при авторизации")
+            raise LoginError("Не удалось получить ответ при авторизации")
 
         if isinstance(result_value, str):
             try:
                 json_data = json.loads(result_value)
             except json.JSONDecodeError as e:
-                raise Exception(f"Некорректный JSON при авторизации: {e}")
+                raise LoginError(f"Некорректный JSON при авторизации: {e}")
         elif isinstance(result_value, dict):
             json_data = result_value
         else:
-            raise Exception("Неизвестный формат ответа при авторизации")
+            raise LoginError("Неизвестный формат ответа при авторизации")
 
         # Сохраняем токен в сервисе
         self.token = json_data.get("accessToken")
@@ -144,24 +200,34 @@ class AlmavivaService:
             info("Вход в учетную запись прошел успешно")
             return json_data
         else:
-            raise Exception("Не удалось войти в учетную запись")
+            raise LoginError("Не удалось войти в учетную запись")
+
+    # Прерывание паузы между городами (вызывается из другого потока)
+    def cancel(self):
+        self.cancelled.set()
 
-    # Проверка доступности визовых слотов на сайте
-    def check_availability(self, tab):
+    # Проверка доступности визовых слотов на сайте для одного города
+    def check_availability(self, tab, city_id, city_name):
         # Устанавливаем заголовки для запроса слотов
-        self.headers["Referer"] = f"{BASE_URL}/appointment"
-        self.headers["Accept-Language"] = "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7"
-        # Строим JavaScript-выражение для проверки доступности слотов
-        expr = self._build_fetch_expression(AVAILABILITY_URL + self.city_id)
-        info(expr)
-        info(f"Проверяем слоты по г. {self.city_name}")
-        resp = tab.Runtime.evaluate(
-            expression=expr,
-            awaitPromise=True,
-        )
+        with self.headers_lock:
+            self.headers["Referer"] = f"{BASE_URL}/appointment"
+            self.headers["Accept-Language"] = "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7"
+        info(f"Проверяем слоты по г. {city_name}")
+        # Выполняем запрос доступности слотов через fetch-хелпер страницы
+        resp = self._fetch(tab, AVAILABILITY_URL + city_id)
         result = str(resp.get("result", {}).get("value", "")).lower().strip() == "true"
         if len(str(resp.get("result", {}).get("value", "")).lower().strip()) != 0:
-            info(f'{f"Места в г. {self.city_name} есть" if result else f"Мест в г. {self.city_name} нет"}')
+            info(f'{f"Места в г. {city_name} есть" if result else f"Мест в г. {city_name} нет"}')
             return result
         else:
-            raise Exception(f"При получении мест для г. {self.city_name} произошла ошибка")
+            raise Exception(f"При получении мест для г. {city_name} произошла ошибка")
+
+    # Проверка всех городов по очереди в одной сессии: {название города: есть ли места}
+    def check_cities(self, tab):
+        results = {}
+        for index, (city_id, city_name) in enumerate(self.cities):
+            # Между городами выдерживаем паузу, чтобы сайт не заблокировал за частые запросы
+            if index and self.cancelled.wait(self.city_check_delay):
+                raise CheckCancelled("Проверка городов прервана")
+            results[city_name] = self.check_availability(tab, city_id, city_name)
+        return results
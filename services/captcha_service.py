@@ -7,10 +7,12 @@
 - проверяет наличие Turnstile на странице
 - отправляет задачу на решение и ожидает ответ
 - возвращает токен решения
+- прерывает ожидание по дедлайну проверки
 """
 
 import json
 import os
+import threading
 import time
 
 import requests
@@ -18,16 +20,48 @@ import requests
 from logger.logger import info
 
 
+# Адрес API сервиса решения капчи (CAPTCHA_API_URL позволяет подменить его локальной заглушкой)
+CAPTCHA_API_URL = os.getenv("CAPTCHA_API_URL", "https://api.2captcha.com")
+# Максимальное время ожидания появления Turnstile на странице в секундах
+TURNSTILE_TIMEOUT = 5
+# Таймаут одного HTTP-запроса к сервису решения капчи в секундах
+CAPTCHA_HTTP_TIMEOUT = 15
+
+
+class CaptchaCancelled(Exception):
+    """Решение капчи прервано по дедлайну проверки."""
+
+
 class CaptchaService:
     """Сервис для решения капч"""
 
-    def __init__(self):
+    def __init__(self, api_key, timeout, poll_interval):
         # Параметры Turnstile пока не получены
         self.ts_params = None
-        # Загружаем API-ключ для сервиса решения капчи из окружения
-        self.api_key = os.getenv("CAPTCHA_API_KEY")
-        # JS-хук для перехвата параметров Turnstile через console.log
+        # Событие выставляется, когда хук сообщил о наличии или отсутствии Turnstile
+        self.ts_resolved = threading.Event()
+        # Событие отмены: прерывает ожидание капчи и ее решения
+        self.cancelled = threading.Event()
+        # API-ключ для сервиса решения капчи
+        self.api_key = api_key
+        # Максимальное время ожидания решения капчи (CAPTCHA_TIMEOUT) и интервал опроса статуса
+        # решения (CAPTCHA_POLL_INTERVAL) в секундах
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        # JS-хук для перехвата параметров Turnstile через console.log.
+        # После загрузки страницы без скриптов Cloudflare хук сразу сообщает, что капчи нет.
+        # Хук выполняется и во вложенных фреймах, поэтому об отсутствии капчи сообщает только основной документ:
+        # иначе фрейм, загрузившийся раньше страницы с проверкой, досрочно сообщил бы, что капчи нет.
         self.hook = r"""
+        window.addEventListener("load", () => {
+          if (window !== window.top) return;
+          const challenge = document.querySelector(
+            'script[src*="challenges.cloudflare.com"], script[src*="/cdn-cgi/challenge-platform/"]'
+          );
+          if (!window.turnstile && !challenge) {
+            console.log(JSON.stringify({type: "TurnstileAbsent"}));
+          }
+        });
         const i = setInterval(()=>{
           if (window.turnstile) {
             clearInterval(i);
@@ -63,22 +97,25 @@ class CaptchaService:
                 data = json.loads(msg)
                 if data.get("type") == "TurnstileTaskProxyless":
                     self.ts_params = data
+                    self.ts_resolved.set()
+                elif data.get("type") == "TurnstileAbsent":
+                    self.ts_resolved.set()
             except:
                 pass
 
         tab.Runtime.consoleAPICalled = _console
 
+    def cancel(self):
+        """Прерывает ожидание капчи и ее решения (вызывается из другого потока)."""
+        self.cancelled.set()
+        self.ts_resolved.set()
+
     def is_turnstile_available(self):
         # Проверяем, доступна ли Turnstile-капча на странице
         info("Проверяем наличие капчи")
-        # Запоминаем время начала ожидания
-        start = time.time()
-        # Ожидаем до 5 секунд появления параметров
-        while self.ts_params is None and time.time() - start < 5:
-            # Параметры пока не получены, продолжаем ждать
-            info("Капча еще не получена")
-            # Короткая пауза перед повторной проверкой
-            time.sleep(0.5)
+        # Ожидаем сигнала от хука о наличии или отсутствии капчи, но не дольше таймаута
+        if not self.ts_resolved.wait(TURNSTILE_TIMEOUT):
+            info("Капча не получена за отведенное время")
         # Проверяем, были ли получены параметры за отведённое время
         if not self.ts_params:
             # Параметры не получены — Turnstile не найден
@@ -106,7 +143,7 @@ class CaptchaService:
         # Логируем отправку задачи на решение
         info("Отправляем капчу на решение")
         # Получаем ответ от 2captcha об успешности создания задачи
-        res = requests.post("https://api.2captcha.com/createTask", json=payload).json()
+        res = requests.post(f"{CAPTCHA_API_URL}/createTask", json=payload, timeout=CAPTCHA_HTTP_TIMEOUT).json()
         if res.get("errorId") != 0:
             # Ошибка при создании задачи: выводим описание ошибки
             raise Exception(
@@ -119,15 +156,18 @@ class CaptchaService:
         # Логируем, что задача принята сервисом
         info("Капча отправлена на решение")
 
-        # Ожидание решения капчи: до ~200 секунд (40 циклов по 5 секунд)
+        # Ожидание решения капчи: не дольше CAPTCHA_TIMEOUT секунд
         token = None
-        for _ in range(40):
-            # Ждем 5 секунд перед проверкой статуса
-            time.sleep(5)
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            # Ждем перед проверкой статуса; отмена прерывает ожидание сразу
+            if self.cancelled.wait(self.poll_interval):
+                raise CaptchaCancelled("Ожидание решения капчи прервано")
             # Запрашиваем статус решения по ID задачи
             r = requests.post(
-                "https://api.2captcha.com/getTaskResult",
+                f"{CAPTCHA_API_URL}/getTaskResult",
                 json={"clientKey": self.api_key, "taskId": task_id},
+                timeout=CAPTCHA_HTTP_TIMEOUT,
             ).json()
             # Решение ещё не готово, продолжаем ждать
             if r.get("status") == "ready":
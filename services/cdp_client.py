@@ -0,0 +1,369 @@
+#  Copyright Feliks Zubarev (c) 2025.
+
+"""
+Модуль клиента Chrome DevTools Protocol (CDP).
+Содержит классы:
+- WebSocketTransport: транспорт сообщений CDP поверх одного WebSocket браузера
+- RecordingTransport: записывает все команды и события CDP в сжатый файл (CDP_RECORD=<папка>)
+- ReplayTransport: воспроизводит записанный файл без браузера (CDP_REPLAY=<файл>)
+- CdpConnection: отправляет команды и разбирает ответы и события в одном потоке чтения
+- CdpSession: вкладка браузера с интерфейсом вида tab.Page.navigate(...) / tab.Page.loadEventFired = cb
+- CdpBrowser: подключение к браузеру, создание и закрытие вкладок
+
+В отличие от pychrome, все вкладки работают через одно соединение с браузером
+(flatten-сессии Target) и один поток чтения, а не два потока на каждую вкладку.
+Обработчики событий вызываются в потоке чтения, поэтому они не должны блокироваться
+и вызывать команды CDP — только сохранять данные и выставлять threading.Event.
+"""
+
+import gzip
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+
+import requests
+import websocket
+
+from logger.logger import error
+
+# Время ожидания ответа на команду CDP по умолчанию в секундах (CDP_CALL_TIMEOUT)
+DEFAULT_CALL_TIMEOUT = float(os.getenv("CDP_CALL_TIMEOUT", "30"))
+
+
+class CdpError(Exception):
+    """Ошибка, которую вернул Chrome в ответ на команду CDP."""
+
+
+class CdpTimeoutError(CdpError):
+    """Chrome не ответил на команду CDP за отведенное время."""
+
+
+class CdpConnectionClosed(CdpError):
+    """Соединение с Chrome закрыто."""
+
+
+class CdpReplayMismatch(CdpError):
+    """Команда не совпала с записанной: поток выполнения отличается от записи."""
+
+
+class WebSocketTransport:
+    """Транспорт сообщений CDP через WebSocket браузера."""
+
+    def __init__(self, ws_url):
+        self.ws_url = ws_url
+        self.ws = None
+
+    def open(self):
+        # Chrome отклоняет подключения с заголовком Origin, поэтому не отправляем его
+        self.ws = websocket.create_connection(self.ws_url, suppress_origin=True)
+
+    def send(self, message):
+        self.ws.send(message)
+
+    def recv(self):
+        return self.ws.recv()
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+
+class RecordingTransport:
+    """
+    Транспорт-обертка, которая записывает все сообщения CDP в файл gzip.
+    Каждая строка файла: [секунды от начала записи, "send" или "recv", сообщение CDP].
+    """
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self._file = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def _write(self, direction, message):
+        with self._lock:
+            if self._file is not None:
+                self._file.write(f'[{time.monotonic() - self._started:.4f},"{direction}",{message}]\n')
+
+    def open(self):
+        self.inner.open()
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._started = time.monotonic()
+
+    def send(self, message):
+        self._write("send", message)
+        self.inner.send(message)
+
+    def recv(self):
+        message = self.inner.recv()
+        self._write("recv", message)
+        return message
+
+    def close(self):
+        try:
+            self.inner.close()
+        finally:
+            with self._lock:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+
+
+class ReplayTransport:
+    """
+    Транспорт, который вместо браузера воспроизводит запись RecordingTransport.
+    Каждая отправленная команда сверяется с очередной записанной, после чего выдаются все
+    сообщения, полученные в записи до следующей команды. Идентификаторы команд
+    подменяются на текущие, поэтому клиент работает с записью как с настоящим браузером.
+    Запись, загруженная заранее через preload, не читается с диска при каждом подключении.
+    """
+
+    # Заранее загруженные записи: путь -> список (направление, сообщение); сообщения только читаются
+    _preloaded = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = self._preloaded.get(path) or self.load(path)
+        self._position = 0
+        # Записанный id команды -> id команды при воспроизведении
+        self._ids = {}
+        self._inbox = queue.SimpleQueue()
+
+    @staticmethod
+    def load(path):
+        """Читает запись: список (направление, сообщение)."""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [(direction, message) for _, direction, message in map(json.loads, f)]
+
+    @classmethod
+    def preload(cls, path):
+        """Читает и разбирает запись один раз; последующие подключения берут ее из памяти."""
+        cls._preloaded[path] = cls.load(path)
+
+    def open(self):
+        # Сообщения, пришедшие в записи до первой команды
+        self._release()
+
+    def _release(self):
+        while self._position < len(self.entries) and self.entries[self._position][0] == "recv":
+            message = dict(self.entries[self._position][1])
+            if "id" in message:
+                message["id"] = self._ids.get(message["id"], message["id"])
+            self._inbox.put(json.dumps(message))
+            self._position += 1
+
+    def send(self, message):
+        message = json.loads(message)
+        if self._position >= len(self.entries):
+            raise CdpReplayMismatch(f"Запись закончилась, а клиент отправил {message['method']}")
+        _, recorded = self.entries[self._position]
+        if recorded.get("method") != message.get("method"):
+            raise CdpReplayMismatch(
+                f"Ожидалась команда {recorded.get('method')}, а клиент отправил {message.get('method')}"
+            )
+        self._ids[recorded["id"]] = message["id"]
+        self._position += 1
+        self._release()
+
+    def recv(self):
+        message = self._inbox.get()
+        if message is None:
+            raise CdpConnectionClosed("Воспроизведение остановлено")
+        return message
+
+    def close(self):
+        self._inbox.put(None)
+
+
+class CdpConnection:
+    """Соединение с браузером: команды CDP и события всех вкладок."""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self._ids = itertools.count(1)
+        # Ожидающие ответа команды: id -> [threading.Event, ответ]
+        self._pending = {}
+        # Обработчики событий: (sessionId, метод) -> callback
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._reader = None
+        self._closed = threading.Event()
+
+    def start(self):
+        """Открывает соединение и запускает поток чтения сообщений."""
+        self.transport.open()
+        self._reader = threading.Thread(target=self._read_loop, name="cdp-reader", daemon=True)
+        self._reader.start()
+
+    def stop(self):
+        """Закрывает соединение и освобождает ожидающие команды."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        try:
+            self.transport.close()
+        except Exception:
+            pass
+        self._release_pending()
+
+    def _release_pending(self):
+        # Будим всех, кто ждет ответа, — ответа уже не будет
+        with self._lock:
+            pending = list(self._pending.values())
+        for slot in pending:
+            slot[0].set()
+
+    def _read_loop(self):
+        while not self._closed.is_set():
+            try:
+                message = json.loads(self.transport.recv())
+            except Exception as e:
+                if not self._closed.is_set():
+                    error(f"Соединение с Chrome прервано - {e}")
+                    self._closed.set()
+                    self._release_pending()
+                return
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        # Ответ на команду
+        if "id" in message:
+            with self._lock:
+                slot = self._pending.get(message["id"])
+            if slot is not None:
+                slot[1] = message
+                slot[0].set()
+            return
+        # Событие
+        with self._lock:
+            callback = self._listeners.get((message.get("sessionId"), message.get("method")))
+        if callback is None:
+            return
+        try:
+            callback(**message.get("params", {}))
+        except Exception as e:
+            error(f"Ошибка в обработчике события {message.get('method')} - {e}")
+
+    def set_listener(self, session_id, method, callback):
+        """Устанавливает (или снимает при callback=None) обработчик события."""
+        with self._lock:
+            if callback is None:
+                self._listeners.pop((session_id, method), None)
+            else:
+                self._listeners[(session_id, method)] = callback
+
+    def get_listener(self, session_id, method):
+        with self._lock:
+            return self._listeners.get((session_id, method))
+
+    def call(self, method, session_id=None, timeout=DEFAULT_CALL_TIMEOUT, **params):
+        """Отправляет команду CDP и ждет ответа не дольше timeout секунд."""
+        if self._closed.is_set():
+            raise CdpConnectionClosed(f"Соединение с Chrome закрыто, вызов {method} невозможен")
+        call_id = next(self._ids)
+        message = {"id": call_id, "method": method, "params": params}
+        if session_id is not None:
+            message["sessionId"] = session_id
+        slot = [threading.Event(), None]
+        with self._lock:
+            self._pending[call_id] = slot
+        try:
+            with self._send_lock:
+                self.transport.send(json.dumps(message))
+            if not slot[0].wait(timeout):
+                raise CdpTimeoutError(f"Chrome не ответил на {method} за {timeout} с")
+        finally:
+            with self._lock:
+                self._pending.pop(call_id, None)
+        response = slot[1]
+        if response is None:
+            raise CdpConnectionClosed(f"Соединение с Chrome закрыто во время вызова {method}")
+        if "error" in response:
+            raise CdpError(f"Ошибка вызова {method} - {response['error'].get('message')}")
+        return response.get("result", {})
+
+
+class _Domain:
+    """Домен CDP вкладки: атрибуты — команды, присваивание — обработчик события."""
+
+    def __init__(self, session, name):
+        self.__dict__["_session"] = session
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, item):
+        method = f"{self._name}.{item}"
+        listener = self._session.connection.get_listener(self._session.session_id, method)
+        if listener is not None:
+            return listener
+        return lambda _timeout=DEFAULT_CALL_TIMEOUT, **params: self._session.call_method(
+            method, _timeout=_timeout, **params
+        )
+
+    def __setattr__(self, key, value):
+        self._session.connection.set_listener(self._session.session_id, f"{self._name}.{key}", value)
+
+
+class CdpSession:
+    """Вкладка браузера, подключенная через flatten-сессию Target."""
+
+    def __init__(self, connection, target_id, session_id):
+        self.connection = connection
+        self.id = target_id
+        self.session_id = session_id
+
+    def call_method(self, method, _timeout=DEFAULT_CALL_TIMEOUT, **params):
+        return self.connection.call(method, session_id=self.session_id, timeout=_timeout, **params)
+
+    def __getattr__(self, item):
+        # Домены CDP называются с заглавной буквы: Page, Network, Runtime...
+        if item[:1].isupper():
+            return _Domain(self, item)
+        raise AttributeError(item)
+
+
+class CdpBrowser:
+    """Подключение к браузеру Chrome по адресу его локального отладчика."""
+
+    def __init__(self, devtools_url, transport=None):
+        self.devtools_url = devtools_url
+        self.transport = transport
+        self.connection = None
+
+    def start(self, timeout=5):
+        """Подключается к WebSocket браузера (или к записи, если задан CDP_REPLAY)."""
+        if self.transport is None:
+            if os.getenv("CDP_REPLAY"):
+                self.transport = ReplayTransport(os.getenv("CDP_REPLAY"))
+            else:
+                version = requests.get(f"{self.devtools_url}/json/version", timeout=timeout).json()
+                self.transport = WebSocketTransport(version["webSocketDebuggerUrl"])
+                # Каждое соединение записывается в отдельный файл в папке CDP_RECORD
+                record_dir = os.getenv("CDP_RECORD")
+                if record_dir:
+                    os.makedirs(record_dir, exist_ok=True)
+                    path = os.path.join(record_dir, f"cdp-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(self)}.jsonl.gz")
+                    self.transport = RecordingTransport(self.transport, path)
+        self.connection = CdpConnection(self.transport)
+        self.connection.start()
+
+    def new_tab(self, url="about:blank"):
+        """Создает новую вкладку и подключается к ней."""
+        target_id = self.connection.call("Target.createTarget", url=url)["targetId"]
+        session_id = self.connection.call(
+            "Target.attachToTarget", targetId=target_id, flatten=True
+        )["sessionId"]
+        return CdpSession(self.connection, target_id, session_id)
+
+    def close_tab(self, tab, timeout=5):
+        """Закрывает вкладку."""
+        self.connection.call("Target.closeTarget", targetId=tab.id, timeout=timeout)
+
+    def close(self):
+        """Закрывает соединение с браузером (сам браузер продолжает работать)."""
+        if self.connection is not None:
+            self.connection.stop()
@@ -4,91 +4,192 @@
 Модуль для управления браузером Chrome через DevTools Protocol (CDP).
 Содержит класс ChromeService, который:
 - подключается к отладчику Chrome
-- открывает страницы и проверяет блокировки
+- блокирует загрузку ненужных для проверки ресурсов (картинки, шрифты, аналитика)
+- открывает страницы и одним запросом получает состояние страницы (блокировка и токен)
 - управляет куки и токенами авторизации
-- завершает работу с вкладкой
+- определяет срок действия допуска Cloudflare и токена авторизации
+- завершает работу с вкладкой, в том числе аварийно по дедлайну проверки из другого потока
 """
 
 import base64
 import json
-import re
+import os
+import threading
 import time
+from urllib.parse import quote
 
-import pychrome
-
-from logger.logger import info
+from logger.logger import info, warning
 from services.almaviva_service import BASE_URL
+from services.cdp_client import CdpBrowser
+
+# Максимальное время ожидания загрузки страницы в секундах (PAGE_LOAD_TIMEOUT)
+PAGE_LOAD_TIMEOUT = float(os.getenv("PAGE_LOAD_TIMEOUT", "15"))
+# Лимиты буфера Network, в котором Chrome хранит тела ответов для DevTools
+NETWORK_MAX_TOTAL_BUFFER = 1024 * 1024
+NETWORK_MAX_RESOURCE_BUFFER = 256 * 1024
+
+# JS-выражение, которое за один вызов собирает состояние страницы:
+# признак страницы блокировки Cloudflare и токен авторизации.
+# Блокировку определяем только по заголовку «Sorry, you have been blocked» (без innerText всей страницы):
+# #cf-error-details есть на любой ошибке Cloudflare, в том числе на недоступности сайта (52x) и лимите запросов (1015)
+PAGE_STATE_EXPRESSION = r"""
+({
+  blocked: !!document.querySelector('[data-translate="block_headline"]')
+    || Array.from(document.querySelectorAll("h1, h2"))
+      .some(h => h.textContent.includes("Sorry, you have been blocked")),
+  authToken: (document.cookie.match(/(?:^|;\s*)auth-token=([^;]+)/) || [])[1] || null
+})
+"""
+
+# Шаблоны URL для каждого типа ресурсов, которые можно не загружать
+RESOURCE_TYPE_PATTERNS = {
+    "image": ["*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.svg*", "*.ico*", "*.avif*"],
+    "font": ["*.woff*", "*.woff2*", "*.ttf*", "*.otf*", "*.eot*"],
+    "media": ["*.mp4*", "*.webm*", "*.mp3*", "*.ogg*", "*.wav*"],
+    "stylesheet": ["*.css*"],
+}
+# Типы ресурсов, которые не загружаются при открытии страницы (пустое значение отключает блокировку)
+BLOCK_RESOURCE_TYPES = [
+    t.strip().lower() for t in os.getenv("BLOCK_RESOURCE_TYPES", "image,font,media").split(",") if t.strip()
+]
+# Дополнительные шаблоны URL, которые не загружаются (по умолчанию — сторонняя аналитика)
+BLOCK_URL_PATTERNS = [
+    p.strip()
+    for p in os.getenv(
+        "BLOCK_URL_PATTERNS",
+        "*google-analytics.com*,*googletagmanager.com*,*doubleclick.net*,"
+        "*mc.yandex.ru*,*connect.facebook.net*,*hotjar.com*",
+    ).split(",")
+    if p.strip()
+]
+
+
+class BlockedError(Exception):
+    """Доступ к сайту заблокирован Cloudflare."""
 
 
 class ChromeService:
     """Сервис для работы с Chrome через CDP."""
 
-    # Инициализация сервиса: таб и заголовки еще не созданы
-    def __init__(self):
+    # Инициализация сервиса: браузер, таб и заголовки еще не созданы
+    def __init__(self, devtools_url):
+        # Адрес локального отладчика запущенного Chrome
+        self.devtools_url = devtools_url
+        self.browser = None
         self.tab = None
         self.headers = {}
+        # Идентификатор главного фрейма вкладки и событие окончания его загрузки
+        self.main_frame_id = None
+        self.page_loaded = threading.Event()
+        # Состояние текущей страницы, прочитанное одним вызовом Runtime.evaluate
+        self.page_state = None
+
+    def _on_load_event_fired(self, **kwargs):
+        """Страница полностью загружена (событие load)."""
+        self.page_loaded.set()
+
+    def _on_frame_stopped_loading(self, **kwargs):
+        """Главный фрейм закончил загрузку."""
+        if self.main_frame_id is None or kwargs.get("frameId") == self.main_frame_id:
+            self.page_loaded.set()
+
+    def wait_for_page_load(self, timeout=PAGE_LOAD_TIMEOUT):
+        """Ожидает окончания загрузки страницы, но не дольше timeout секунд."""
+        if self.page_loaded.wait(timeout):
+            info("Страница загружена")
+            return True
+        warning(f"Страница не загрузилась за {timeout} с, продолжаем")
+        return False
 
     def connect(self):
         """Подключение к локальному отладчику Chrome."""
         # Подключаемся к локальному дебаг-порту Chrome через CDP
-        browser = pychrome.Browser(url="http://127.0.0.1:9222")
-        # Создаем новую вкладку в браузере для управления
-        self.tab = browser.new_tab()
-        # Запускаем сессию CDP на этой вкладке
-        self.tab.start()
+        self.browser = CdpBrowser(self.devtools_url)
+        # Открываем одно соединение CDP с браузером
+        self.browser.start()
+        # Создаем новую вкладку в уже запущенном браузере и подключаемся к ней
+        self.tab = self.browser.new_tab()
+        # Подписываемся на события загрузки страницы вместо фиксированных пауз
+        self.tab.Page.loadEventFired = self._on_load_event_fired
+        self.tab.Page.frameStoppedLoading = self._on_frame_stopped_loading
         # Включаем домен Page для управления страницей
         self.tab.Page.enable()
-        # Включаем домен Network для перехвата запросов
-        self.tab.Network.enable()
+        # Включаем домен Network с ограниченным буфером тел ответов, чтобы память вкладки не росла
+        self.tab.Network.enable(
+            maxTotalBufferSize=NETWORK_MAX_TOTAL_BUFFER,
+            maxResourceBufferSize=NETWORK_MAX_RESOURCE_BUFFER,
+        )
+        # Отключаем загрузку ресурсов, которые не нужны для проверки
+        self.block_resources()
         # Включаем домен Runtime для исполнения JS-кода
         self.tab.Runtime.enable()
         # Логируем готовность Chrome к работе
         info("Chrome готов к работе")
 
+    def block_resources(self):
+        """Запрещает загрузку ненужных ресурсов на вкладке по шаблонам URL."""
+        patterns = [p for t in BLOCK_RESOURCE_TYPES for p in RESOURCE_TYPE_PATTERNS.get(t, [])]
+        patterns += BLOCK_URL_PATTERNS
+        if patterns:
+            self.tab.Network.setBlockedURLs(urls=patterns)
+
     def open_main_page(self):
         # Навигация на главный URL визового центра
         info("Открываем главную страницу визового центра")
-        # Отправляем команду перехода на основной сайт
-        self.tab.Page.navigate(url=BASE_URL)
+        self.page_loaded.clear()
+        self.page_state = None
+        # Отправляем команду перехода на основной сайт и запоминаем главный фрейм
+        nav = self.tab.Page.navigate(url=BASE_URL)
+        self.main_frame_id = nav.get("frameId", self.main_frame_id)
         # Ждем загрузки страницы после навигации
-        time.sleep(3)
+        self.wait_for_page_load()
+
+    def read_page_state(self):
+        """Возвращает состояние страницы (blocked, authToken), читая его не более одного раза на документ."""
+        if self.page_state is None:
+            resp = self.tab.Runtime.evaluate(expression=PAGE_STATE_EXPRESSION, returnByValue=True)
+            self.page_state = resp.get("result", {}).get("value") or {}
+        return self.page_state
 
     def check_if_blocked(self):
         # Начинаем проверку наличия блокировки Cloudflare
         info("Проверка на блокировку от Cloudflare")
-        # Выполняем JS в контексте страницы, проверяя текст на предмет блокировки
-        block_resp = self.tab.Runtime.evaluate(
-            expression='document.body.innerText.includes("Sorry, you have been blocked")'
-        )
-        # Если текст содержит сообщение о блокировке, выбрасываем исключение
-        if block_resp.get("result", {}).get("value", False):
-            raise Exception("Произошла блокировка от CloudFlare")
+        # Если на странице есть признаки страницы блокировки, выбрасываем исключение
+        if self.read_page_state().get("blocked", False):
+            raise BlockedError("Произошла блокировка от CloudFlare")
         # Логируем, что блокировка не найдена
         else:
             info("Блокировка не обнаружена")
 
+    @staticmethod
+    def get_token_expiry(token):
+        """Возвращает время окончания действия JWT-токена (поле exp) в секундах."""
+        # Декодируем payload JWT и извлекаем поле exp
+        payload_b64 = token.split(".")[1] + "=" * (-len(token.split(".")[1]) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(payload_b64).decode())
+        return payload.get("exp", 0)
+
+    def get_clearance_expiry(self):
+        """Возвращает время окончания действия куки допуска Cloudflare (cf_clearance) или None."""
+        cookies = self.tab.Network.getCookies(urls=[BASE_URL]).get("cookies", [])
+        for cookie in cookies:
+            # Сессионная куки (expires = -1) не переживет перезапуск браузера, срок неизвестен
+            if cookie.get("name") == "cf_clearance" and cookie.get("expires", -1) > 0:
+                return int(cookie["expires"])
+        return None
+
     def check_current_login(self):
         """Проверка и возврат существующего токена из куки."""
         # Проверяем наличие и актуальность токена авторизации в куки
         info("Проверка текущего логина")
-        # Получаем строку cookie из браузера
-        cookie_resp = self.tab.Runtime.evaluate(expression="document.cookie")
-        cookies = cookie_resp.get("result", {}).get("value", "")
-        # Ищем в cookie auth-token
-        m = re.search(r"auth-token=([^;]+)", cookies)
-        auth_token = None
-        if m:
-            auth_token = m.group(1)
+        # Токен из куки уже прочитан вместе с остальным состоянием страницы
+        auth_token = self.read_page_state().get("authToken")
+        if auth_token:
             info("Найден текущий логин, проверка актуальности")
         # Если токен найден, проверяем его срок действия
         if auth_token:
             try:
-                # Декодируем payload JWT и извлекаем поле exp
-                payload_b64 = auth_token.split(".")[1] + "=" * (
-                    -len(auth_token.split(".")[1]) % 4
-                )
-                payload = json.loads(base64.urlsafe_b64decode(payload_b64).decode())
-                exp = payload.get("exp", 0)
+                exp = self.get_token_expiry(auth_token)
                 # Логируем, что токен все еще действителен
                 if exp > int(time.time()):
                     info("Текущий логин еще актуален")
@@ -114,49 +215,57 @@ class ChromeService:
             raise Exception("Токен при сохранении пользователя в куки не найден")
 
         # Декодируем payload токена для получения exp
-        payload_b64 = token.split(".")[1] + "=" * (-len(token.split(".")[1]) % 4)
-        exp = json.loads(base64.urlsafe_b64decode(payload_b64)).get("exp", 0)
-        # Вычисляем время жизни токена в секундах
-        ttl = max(exp - int(time.time()), 0)
-        # Устанавливаем cookie auth-token в браузере
-        self.tab.Runtime.evaluate(
-            expression=f'document.cookie="auth-token={token}; Path=/; Max-Age={ttl}";'
-        )
-        # Устанавливаем cookie с данными пользователя
-        user_json = json.dumps(login_data)
-        self.tab.Runtime.evaluate(
-            expression=f'document.cookie="auth-user="+encodeURIComponent({user_json})+"; Path=/; Max-Age={ttl}";'
+        exp = self.get_token_expiry(token)
+        # Данные пользователя кодируем так же, как encodeURIComponent на странице
+        user_value = quote(json.dumps(login_data), safe="!~*'()")
+        # Устанавливаем cookie auth-token и auth-user одним вызовом
+        self.tab.Network.setCookies(
+            cookies=[
+                {"name": "auth-token", "value": token, "url": BASE_URL, "path": "/", "expires": exp},
+                {"name": "auth-user", "value": user_value, "url": BASE_URL, "path": "/", "expires": exp},
+            ]
         )
         # Логируем, что пользователь сохранен в куки
         info("Пользователь сохранен в куках")
 
     def inject_captcha_token(self, captcha_token):
+        self.page_loaded.clear()
+        # После капчи страница перезагружается, прочитанное состояние устаревает
+        self.page_state = None
         # Отправляем токен капчи в окно страницы
         self.tab.Runtime.evaluate(expression=f'window.tsCallback("{captcha_token}");')
         # Логируем ожидание загрузки после ввода капчи
         info("Ждем загрузки страницы после инъекции капчи")
-        # Пауза для завершения загрузки страницы
-        time.sleep(3)
+        # Ждем завершения загрузки страницы после прохождения капчи
+        self.wait_for_page_load()
+
+    def abort(self):
+        """
+        Аварийно прерывает работу с вкладкой из другого потока (по дедлайну проверки).
+        Закрытие соединения будит все ожидающие ответа команды CDP с CdpConnectionClosed.
+        """
+        warning("Прерываем работу с вкладкой")
+        if self.tab is not None:
+            try:
+                self.browser.close_tab(self.tab, timeout=2)
+            except Exception:
+                pass
+        if self.browser is not None:
+            self.browser.close()
+        # Не даем основному потоку ждать загрузки страницы, которой уже не будет
+        self.page_loaded.set()
 
     def finish(self):
         # Начало процесса завершения работы с вкладкой
         info("Завершаем работу с вкладкой")
-        # Отключаем домен Page перед остановкой
-        try:
-            self.tab.Page.disable()
-        except Exception:
-            pass
-        # Отключаем домен Network перед остановкой
-        try:
-            self.tab.Network.disable()
-        except Exception:
-            pass
-        # Отключаем домен Runtime перед остановкой
-        try:
-            self.tab.Runtime.disable()
-        except Exception:
-            pass
-        # Останавливаем сессии CDP и WebSocket
-        self.tab.stop()
+        # Закрываем вкладку, чтобы резидентный браузер не копил открытые страницы
+        if self.tab is not None:
+            try:
+                self.browser.close_tab(self.tab, timeout=5)
+            except Exception:
+                pass
+        # Закрываем соединение CDP с браузером
+        if self.browser is not None:
+            self.browser.close()
         # Логируем завершение работы с вкладкой
         info("Работа с вкладкой завершена, завершаем выполнение скрипта")
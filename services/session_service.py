@@ -0,0 +1,90 @@
+#  Copyright Feliks Zubarev (c) 2025.
+
+"""
+Модуль для хранения состояния сессии между запусками.
+Содержит класс SessionService, который:
+- хранит рядом с профилем Chrome время окончания допуска Cloudflare и токена авторизации
+- сообщает, можно ли пропустить ожидание капчи и вход в учетную запись
+- сбрасывает сохраненное состояние, если оно оказалось недействительным
+"""
+
+import json
+import os
+import time
+
+from logger.logger import info, warning
+
+# Запас времени в секундах, при котором сохраненная сессия уже считается истекшей
+EXPIRY_MARGIN = 60
+
+
+class SessionService:
+    """Сервис для хранения состояния сессии на диске."""
+
+    def __init__(self, city_id):
+        # Файл состояния лежит рядом с профилем Chrome для этого города
+        self.path = os.path.expanduser('~') + f'/almaviva-chrome-profiles/city-{city_id}-session.json'
+        # Время окончания действия допуска Cloudflare и токена авторизации (unix-время)
+        self.clearance_expires_at = None
+        self.auth_expires_at = None
+        self.load()
+
+    def load(self):
+        """Загружает сохраненное состояние сессии, если оно есть."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.clearance_expires_at = saved.get("clearance_expires_at")
+            self.auth_expires_at = saved.get("auth_expires_at")
+        except FileNotFoundError:
+            pass
+        # Поврежденный файл не мешает работе — просто проходим полный путь проверки
+        except (OSError, ValueError) as e:
+            warning(f"Не удалось прочитать состояние сессии - {e}")
+
+    def save(self):
+        """Сохраняет состояние сессии на диск."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Пишем во временный файл и подменяем им основной, чтобы не оставить файл недописанным
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "clearance_expires_at": self.clearance_expires_at,
+                    "auth_expires_at": self.auth_expires_at,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _is_alive(expires_at):
+        return expires_at is not None and expires_at - EXPIRY_MARGIN > time.time()
+
+    def is_clearance_valid(self):
+        """Проверяет, что сохраненный допуск Cloudflare еще действует."""
+        return self._is_alive(self.clearance_expires_at)
+
+    def is_auth_valid(self):
+        """Проверяет, что сохраненный токен авторизации еще действует."""
+        return self._is_alive(self.auth_expires_at)
+
+    def is_valid(self):
+        """Проверяет, что можно пропустить ожидание капчи и вход в учетную запись."""
+        return self.is_clearance_valid() and self.is_auth_valid()
+
+    def update(self, clearance_expires_at, auth_expires_at):
+        """Обновляет и сохраняет состояние сессии."""
+        self.clearance_expires_at = clearance_expires_at
+        self.auth_expires_at = auth_expires_at
+        try:
+            self.save()
+        except OSError as e:
+            warning(f"Не удалось сохранить состояние сессии - {e}")
+
+    def invalidate(self):
+        """Сбрасывает сохраненное состояние, чтобы следующий запуск прошел полный путь."""
+        if self.clearance_expires_at is None and self.auth_expires_at is None:
+            return
+        info("Сбрасываем сохраненное состояние сессии")
+        self.update(None, None)
@@ -1,27 +1,147 @@
 #  Copyright Feliks Zubarev (c) 2025.
-import datetime
-
-from logger.logger import info, telegram
+"""
+Модуль уведомлений о результатах проверки в Telegram.
+Содержит класс TelegramService, который в зависимости от TELEGRAM_NOTIFY_MODE:
+- always (по умолчанию): отправляет сообщение после каждой проверки
+- changes: отправляет сообщение только при изменении наличия мест и, если задан
+  TELEGRAM_HEARTBEAT_HOURS, сводку раз в указанное число часов без изменений
+При проверке нескольких городов отправляется одно общее сообщение со строкой на каждый город.
+Состояние режима changes хранится в файле рядом с профилем Chrome (city-<CITY_ID>-telegram.json),
+поэтому и при запуске с --once сообщение уходит только при изменении наличия мест.
+"""
 
+import json
 import os
+import time
+
+from logger.logger import debug, info, telegram, warning
 
 
 class TelegramService:
+    # Результаты последней отправленной проверки {город: есть ли места} (None — сообщений еще не было)
+    last_available = None
+    # Время последнего отправленного сообщения (unix-время, чтобы пережить перезапуск)
+    last_sent_at = None
+    # Количество проверок с момента последнего сообщения
+    checks_since_sent = 0
+    # Файл, в котором сохраняется состояние (None — только в памяти)
+    path = None
+    # Режим уведомлений (TELEGRAM_NOTIFY_MODE) и период сводки без изменений в часах (TELEGRAM_HEARTBEAT_HOURS)
+    notify_mode = "always"
+    heartbeat_hours = 0.0
+
+    @classmethod
+    def configure(cls, settings):
+        """Применяет настройки уведомлений и загружает сохраненный результат последнего сообщения для города."""
+        cls.notify_mode = settings.telegram_notify_mode
+        cls.heartbeat_hours = settings.telegram_heartbeat_hours
+        path = os.path.expanduser('~') + f'/almaviva-chrome-profiles/city-{settings.city_id}-telegram.json'
+        if path == cls.path:
+            return
+        cls.path = path
+        cls.last_available = None
+        cls.last_sent_at = None
+        cls.checks_since_sent = 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            cls.last_available = saved.get("last_available")
+            cls.last_sent_at = saved.get("last_sent_at")
+            cls.checks_since_sent = saved.get("checks_since_sent", 0)
+        except FileNotFoundError:
+            pass
+        # Поврежденный файл не мешает работе — просто отправим следующее сообщение
+        except (OSError, ValueError, AttributeError) as e:
+            warning(f"Не удалось прочитать состояние уведомлений - {e}")
+
+    @classmethod
+    def save(cls):
+        """Сохраняет состояние на диск; ошибка записи только пишется в лог."""
+        if cls.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(cls.path), exist_ok=True)
+            # Пишем во временный файл и подменяем им основной, чтобы не оставить файл недописанным
+            tmp_path = f"{cls.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "last_available": cls.last_available,
+                        "last_sent_at": cls.last_sent_at,
+                        "checks_since_sent": cls.checks_since_sent,
+                    },
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp_path, cls.path)
+        except OSError as e:
+            warning(f"Не удалось сохранить состояние уведомлений - {e}")
+
+    @classmethod
+    def _changes_mode(cls):
+        return cls.notify_mode == "changes"
+
+    @classmethod
+    def reset(cls):
+        """Забывает результат последнего сообщения (например, после смены города)."""
+        cls.last_available = None
+        cls.last_sent_at = None
+        cls.checks_since_sent = 0
+        if cls._changes_mode():
+            cls.save()
+
+    @classmethod
+    def _should_send(cls, results):
+        """Определяет, нужно ли отправлять сообщение по результату проверки."""
+        if not cls._changes_mode():
+            return True
+        # Первое сообщение для города и любое изменение наличия мест отправляем всегда
+        if cls.last_available is None or results != cls.last_available:
+            return True
+        # Без изменений отправляем только периодическую сводку, если она включена
+        heartbeat = cls.heartbeat_hours * 3600
+        return heartbeat > 0 and (cls.last_sent_at is None or time.time() - cls.last_sent_at >= heartbeat)
+
     @staticmethod
-    def send_telegram_message(is_available):
-        # Формируем заголовок push-уведомления
-        title = f"Almaviva в г. {os.getenv("CITY_NAME")}"
+    def _status_text(is_available):
+        """Текст о наличии мест в одном городе."""
+        # Если места доступны, готовим приоритетное уведомление, иначе — сообщение об их отсутствии
+        return "места ЕСТЬ" if is_available else "мест нет"
 
-        # Если места доступны, готовим приоритетное уведомление
-        if is_available:
-            body_text = f"места ЕСТЬ"
+    @classmethod
+    def send_telegram_message(cls, results):
+        """Отправляет одно сообщение по результатам проверки {название города: есть ли места}."""
+        cls.checks_since_sent += 1
+        if not cls._should_send(results):
+            debug("Наличие мест не изменилось, сообщение в телеграм не отправляем")
+            # Счетчик проверок нужен следующей сводке, в том числе после перезапуска
+            cls.save()
+            return
+
+        # В сводке без изменений указываем, сколько проверок прошло с прошлого сообщения
+        suffix = ""
+        if cls.last_available is not None and results == cls.last_available and cls.checks_since_sent > 1:
+            suffix = f" (проверок с прошлого сообщения: {cls.checks_since_sent})"
+
+        if len(results) == 1:
+            # Для одного города — одна строка с заголовком
+            city_name, is_available = next(iter(results.items()))
+            text = f"Almaviva в г. {city_name} - {cls._status_text(is_available)}{suffix}"
         else:
-            # Если мест нет, формируем соответствующее уведомление
-            body_text = f"мест нет"
+            # Для нескольких городов — заголовок и строка на каждый город, города с местами первыми
+            lines = [f"г. {name} - {cls._status_text(available)}"
+                     for name, available in sorted(results.items(), key=lambda item: not item[1])]
+            text = "\n".join([f"Almaviva{suffix}:", *lines])
 
-        # Отправляем текстовую нотификацию в Telegram
+        # Ставим текстовую нотификацию в очередь отправки в Telegram
         try:
+            telegram(text)
             info("Отправили сообщение в телеграм")
-            telegram(f"{title} - {body_text}")
         except Exception as e:
             raise Exception(f"Не удалось отправить сообщение в телеграм - ошибка: {e}")
+
+        cls.last_available = dict(results)
+        cls.last_sent_at = time.time()
+        cls.checks_since_sent = 0
+        if cls._changes_mode():
+            cls.save()